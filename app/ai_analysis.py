@@ -1,8 +1,85 @@
 """Module d'analyse IA amélioré pour l'analyse financière"""
+import os
 import time
 import json
+import threading
 import ollama
 from datetime import datetime
+from itertools import islice
+
+from signal_extractor import strip_code_fences
+
+# orjson (C) si disponible, sinon json standard
+# orjson.JSONDecodeError hérite de json.JSONDecodeError: les except restent valables
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# Appels Ollama simultanés au plus (aligné sur OLLAMA_NUM_PARALLEL côté serveur):
+# au-delà, les requêtes s'empilent côté serveur et se disputent la mémoire du modèle
+OLLAMA_MAX_CONCURRENT = max(1, int(os.getenv('OLLAMA_NUM_PARALLEL', '3')))
+_ollama_slots = threading.BoundedSemaphore(OLLAMA_MAX_CONCURRENT)
+
+# Client unique: connexions HTTP réutilisées d'un appel à l'autre
+_client = ollama.Client(host=os.getenv('OLLAMA_HOST'))
+# Durée pendant laquelle Ollama garde le modèle chargé après un appel
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+# Contexte (num_ctx) identique pour tous les appels, résumés de news compris: Ollama recharge
+# le modèle dès que num_ctx change. Dimensionné pour le plus gros prompt (portefeuille + relance)
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', '16384'))
+
+
+def _with_num_ctx(kwargs):
+    """
+    Fixe num_ctx à OLLAMA_NUM_CTX dans les options d'un appel chat
+    (et signale un prompt qui risque d'être tronqué)
+    """
+    options = {**kwargs.get('options', {}), 'num_ctx': OLLAMA_NUM_CTX}
+    kwargs['options'] = options
+    kwargs.setdefault('keep_alive', OLLAMA_KEEP_ALIVE)
+    # ~3 caractères par token: estimation prudente pour du français chiffré
+    needed = sum(len(m['content']) for m in kwargs['messages']) // 3 + options.get('num_predict', 0)
+    if needed > OLLAMA_NUM_CTX:
+        print(f"   ⚠️ Prompt estimé à ~{needed} tokens > num_ctx {OLLAMA_NUM_CTX}: risque de troncature")
+    return kwargs
+
+
+def _chat(**kwargs):
+    """Appel chat sur le client partagé, borné par le sémaphore entre les threads d'analyse"""
+    _with_num_ctx(kwargs)
+    with _ollama_slots:
+        return _client.chat(**kwargs)
+
+
+def _log_eval_count(label, final_chunk, num_predict):
+    """Affiche le nombre de tokens générés (eval_count) et signale une réponse tronquée"""
+    eval_count = final_chunk.get('eval_count') if final_chunk else None
+    if eval_count is None:
+        return
+    print(f"   🔢 Tokens générés ({label}): {eval_count}/{num_predict}")
+    if eval_count >= num_predict:
+        print(f"   ⚠️ Plafond num_predict atteint pour {label}: réponse probablement tronquée")
+
+
+def _chat_stream(**kwargs):
+    """
+    Appel chat en streaming: les fragments sont accumulés pendant le décodage
+    (le sémaphore reste tenu jusqu'à la fin du flux)
+    
+    Returns:
+        tuple: (texte_complet, dernier_fragment) - le dernier fragment porte les statistiques (eval_count...)
+    """
+    _with_num_ctx(kwargs)
+    content_parts = []
+    last_chunk = None
+    with _ollama_slots:
+        for chunk in _client.chat(stream=True, **kwargs):
+            content_parts.append(chunk['message']['content'])
+            last_chunk = chunk
+    return ''.join(content_parts), last_chunk
 
 
 # JSON Schema pour la réponse structurée
@@ -32,6 +109,158 @@ ANALYSIS_JSON_SCHEMA = {
     "conclusion": "Synthèse finale"
 }
 
+# Prompt système de l'analyste (partagé entre analyse simple et groupée)
+SYSTEM_PROMPT_ANALYSIS = """Tu es un analyste financier senior avec 20 ans d'expérience dans les marchés actions.
+Tu fournis des analyses approfondies, précises, factuelles et actionnables.
+Tu réponds UNIQUEMENT en JSON valide, sans texte avant ou après.
+Tu ne fais jamais de prédictions garanties mais donnes des probabilités et scénarios.
+Tu utilises un langage professionnel mais accessible en français.
+Tu justifies toujours tes recommandations avec des données chiffrées.
+Tu identifies les risques autant que les opportunités.
+Tu donnes des niveaux de prix précis pour l'entrée, le stop-loss et les objectifs."""
+
+SYSTEM_PROMPT_PORTFOLIO = """Tu es un gestionnaire de portefeuille expérimenté.
+Tu analyses les positions d'un investisseur et fournis des conseils actionnables.
+Tu réponds UNIQUEMENT en JSON valide, sans texte avant ou après.
+Tu priorises la gestion du risque et la préservation du capital.
+Tu donnes des conseils précis et justifiés pour chaque position.
+Tu identifies les opportunités d'optimisation du portefeuille."""
+
+# Relance unique si la réponse portefeuille n'est pas un JSON valide
+PORTFOLIO_JSON_RETRY_PROMPT = """Ta précédente réponse n'était pas du JSON valide.
+Réponds uniquement avec l'objet JSON demandé, complet et bien formé, sans aucun texte autour."""
+
+# Blocs statiques du prompt d'analyse (identiques pour toutes les actions)
+ANALYSIS_PROMPT_INSTRUCTIONS = """## INSTRUCTIONS
+Tu es un analyste financier senior. Analyse les données suivantes et fournis une recommandation claire et actionnable.
+
+**FORMAT DE RÉPONSE OBLIGATOIRE:**
+1. Commence TOUJOURS par une ligne: `SIGNAL: [ACHETER/VENDRE/CONSERVER]`
+2. Puis une ligne: `CONVICTION: [Forte/Moyenne/Faible]`
+3. Puis une ligne: `RÉSUMÉ: [Une phrase de synthèse]`
+4. Ensuite ton analyse détaillée
+
+---
+"""
+
+# Consignes et schéma JSON, jusqu'aux niveaux de prix (calculés par action)
+ANALYSIS_PROMPT_GUIDELINES = """
+---
+
+## CONSIGNES D'ANALYSE
+
+1. **Analyse technique:** Interprète les indicateurs de manière cohérente, identifie les divergences, les croisements de moyennes mobiles, et les patterns chartistes
+2. **Analyse fondamentale:** Évalue la valorisation par rapport au secteur et aux moyennes historiques. Compare les multiples (P/E, PEG) aux pairs
+3. **Catalyseurs:** Identifie les événements pouvant impacter le cours (earnings, annonces, M&A, macro)
+4. **Risques:** Liste les principaux risques à surveiller (sectoriels, macro, spécifiques à l'entreprise)
+5. **Niveaux clés:** Définis des points d'entrée/sortie précis basés sur support/résistance et ATR
+6. **Horizon temporel:** Distingue court terme (1-5 jours), moyen terme (1-3 mois), long terme (6+ mois)
+
+## FORMAT DE RÉPONSE - JSON OBLIGATOIRE
+
+Réponds UNIQUEMENT avec un objet JSON valide, sans texte avant ou après.
+Respecte EXACTEMENT ce schéma:
+
+```json
+{
+  "signal": "ACHETER" | "VENDRE" | "CONSERVER",
+  "conviction": "Forte" | "Moyenne" | "Faible",
+  "resume": "Synthèse détaillée de 3-4 phrases: situation actuelle, facteurs clés, et recommandation avec horizon temporel",
+  "analyse_technique": {
+    "tendance": "Haussière" | "Baissière" | "Neutre",
+    "tendance_details": "Description détaillée de la tendance avec les niveaux clés et la force du mouvement",
+    "rsi_interpretation": "Analyse complète du RSI: niveau actuel, zones de surachat/survente, divergences éventuelles",
+    "macd_interpretation": "Analyse du MACD: position par rapport au signal, momentum, croisements récents ou à venir",
+    "moyennes_mobiles": "Position du prix par rapport aux MA20/50/200, golden/death cross potentiels",
+    "volatilite": "Niveau ATR, implications pour le sizing de position et les stops",
+    "volumes": "Analyse des volumes: confirmation de tendance, divergences, accumulation/distribution",
+    "pattern": "Patterns chartistes identifiés (si présents): support, résistance, figures"
+  },
+  "analyse_fondamentale": {
+    "valorisation": "Évaluation détaillée: P/E vs historique et secteur, PEG ratio, valeur relative",
+    "qualite_entreprise": "Points sur la qualité du business: marges, croissance, avantages compétitifs",
+    "points_forts": ["Force 1 avec explication", "Force 2 avec explication", "Force 3"],
+    "points_faibles": ["Faiblesse 1 avec explication", "Faiblesse 2 avec explication"]
+  },
+  "sentiment_marche": {
+    "consensus_analystes": "Synthèse des recommandations analystes et objectifs de cours",
+    "news_impact": "Impact des actualités récentes sur le titre",
+    "flux_institutionnels": "Tendance des flux si disponible"
+  },
+  "catalyseurs": [
+    {"type": "positif", "horizon": "court/moyen/long terme", "description": "Description détaillée du catalyseur et son impact potentiel"},
+    {"type": "negatif", "horizon": "court/moyen/long terme", "description": "Description du risque et probabilité"}
+  ],
+  "risques": {
+    "risque_principal": "Le risque majeur à surveiller avec son déclencheur potentiel",
+    "risques_secondaires": ["Risque 2 avec contexte", "Risque 3 avec contexte"],
+    "stop_loss_justification": "Pourquoi ce niveau de stop est approprié"
+  },
+  "niveaux": {
+"""
+
+# Fin du schéma JSON après les niveaux de prix
+ANALYSIS_PROMPT_FOOTER = """    "ratio_risk_reward": "Calcul du ratio risque/rendement",
+    "invalidation": "Niveau qui invaliderait le scénario"
+  },
+  "plan_trading": {
+    "entree": "Conditions idéales pour entrer en position",
+    "gestion": "Comment gérer la position (trailing stop, prise de profits partielle)",
+    "sortie": "Conditions de sortie autres que TP/SL"
+  },
+  "conclusion": "Synthèse finale de 4-5 phrases: contexte actuel, opportunité ou risque principal, niveaux clés à surveiller, et recommandation claire avec conviction et horizon"
+}
+```
+
+IMPORTANT:
+- Retourne UNIQUEMENT le JSON, pas de texte explicatif
+- Utilise des nombres pour les prix (pas de $)
+- Les niveaux doivent être réalistes par rapport au support/résistance
+- Chaque liste doit contenir au moins un élément
+"""
+
+# Plafond de tokens générés par analyse: une réponse JSON complète tient
+# largement dedans, le reste ne servait qu'aux dérives/répétitions du modèle
+ANALYSIS_NUM_PREDICT = 3072
+
+# Niveaux par défaut du schéma, en ratio du prix actuel
+STOP_LOSS_RATIO = 0.95
+TARGET_1_RATIO = 1.10
+TARGET_2_RATIO = 1.20
+
+# Position du prix par rapport à une moyenne mobile, indexée par bool(prix > MA)
+# (bool() requis: les prix pandas donnent un numpy.bool, refusé comme indice de tuple)
+_MA_POS = ("EN-DESSOUS ❌", "AU-DESSUS ✅")
+
+
+def _first(d, *keys, default=''):
+    """Retourne la première valeur non vide parmi les clés données (sinon default)"""
+    for key in keys:
+        value = d.get(key)
+        if value:
+            return value
+    return default
+
+
+def _format_market_cap(market_cap):
+    """
+    Formate une capitalisation boursière (T$/B$/M$)
+    
+    Args:
+        market_cap: Capitalisation en dollars (0/None si inconnue)
+    
+    Returns:
+        str: Capitalisation formatée ou "N/A"
+    """
+    if market_cap and market_cap > 0:
+        if market_cap >= 1e12:
+            return f"{market_cap/1e12:.2f}T$"
+        elif market_cap >= 1e9:
+            return f"{market_cap/1e9:.2f}B$"
+        else:
+            return f"{market_cap/1e6:.2f}M$"
+    return "N/A"
+
 
 def build_analysis_prompt(ticker, hist_1mo, info, indicators, advanced=False, 
                           news=None, calendar=None, recommendations=None):
@@ -53,58 +282,48 @@ def build_analysis_prompt(ticker, hist_1mo, info, indicators, advanced=False,
     """
     
     # === DONNÉES DE BASE ===
-    current_price = hist_1mo['Close'].iloc[-1] if not hist_1mo.empty else 0
-    open_price = hist_1mo['Open'].iloc[-1] if not hist_1mo.empty else 0
-    high_price = hist_1mo['High'].iloc[-1] if not hist_1mo.empty else 0
-    low_price = hist_1mo['Low'].iloc[-1] if not hist_1mo.empty else 0
-    volume = hist_1mo['Volume'].iloc[-1] if not hist_1mo.empty else 0
-    
+    if hist_1mo.empty:
+        current_price = open_price = high_price = low_price = volume = 0
+    else:
+        # Une seule lecture de la dernière séance
+        last = hist_1mo.iloc[-1]
+        current_price = last['Close']
+        open_price = last['Open']
+        high_price = last['High']
+        low_price = last['Low']
+        volume = last['Volume']
+
     # Variation sur le mois
     if len(hist_1mo) >= 2:
-        monthly_change = ((current_price - hist_1mo['Close'].iloc[0]) / 
-                          hist_1mo['Close'].iloc[0] * 100)
+        first_close = hist_1mo['Close'].iat[0]
+        monthly_change = (current_price - first_close) / first_close * 100
     else:
         monthly_change = 0
     
     # === INFORMATIONS ENTREPRISE ===
-    company_name = info.get('longName', ticker)
-    sector = info.get('sector', 'N/A')
-    industry = info.get('industry', 'N/A')
-    market_cap = info.get('marketCap', 0)
-    pe_ratio = info.get('trailingPE', 'N/A')
-    forward_pe = info.get('forwardPE', 'N/A')
-    peg_ratio = info.get('pegRatio', 'N/A')
-    dividend_yield = info.get('dividendYield', 0)
-    beta = info.get('beta', 'N/A')
-    target_price = info.get('targetMeanPrice', 'N/A')
-    recommendation = info.get('recommendationKey', 'N/A')
+    nf = info.get
+    company_name = nf('longName', ticker)
+    sector = nf('sector', 'N/A')
+    industry = nf('industry', 'N/A')
+    market_cap = nf('marketCap', 0)
+    pe_ratio = nf('trailingPE', 'N/A')
+    forward_pe = nf('forwardPE', 'N/A')
+    peg_ratio = nf('pegRatio', 'N/A')
+    dividend_yield = nf('dividendYield', 0)
+    beta = nf('beta', 'N/A')
+    target_price = nf('targetMeanPrice', 'N/A')
+    recommendation = nf('recommendationKey', 'N/A')
     
     # Formatage market cap
-    if market_cap and market_cap > 0:
-        if market_cap >= 1e12:
-            market_cap_str = f"{market_cap/1e12:.2f}T$"
-        elif market_cap >= 1e9:
-            market_cap_str = f"{market_cap/1e9:.2f}B$"
-        else:
-            market_cap_str = f"{market_cap/1e6:.2f}M$"
-    else:
-        market_cap_str = "N/A"
+    market_cap_str = _format_market_cap(market_cap)
     
     # === CONSTRUCTION DU PROMPT ===
-    prompt = f"""# ANALYSE FINANCIÈRE PROFESSIONNELLE - {ticker}
+    # Instructions statiques en tête: préfixe identique (système + instructions)
+    # d'une action à l'autre, réutilisable par le cache KV d'Ollama
+    parts = [f"""{ANALYSIS_PROMPT_INSTRUCTIONS}
+# ANALYSE FINANCIÈRE PROFESSIONNELLE - {ticker}
 Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}
 
-## INSTRUCTIONS
-Tu es un analyste financier senior. Analyse les données suivantes et fournis une recommandation claire et actionnable.
-
-**FORMAT DE RÉPONSE OBLIGATOIRE:**
-1. Commence TOUJOURS par une ligne: `SIGNAL: [ACHETER/VENDRE/CONSERVER]`
-2. Puis une ligne: `CONVICTION: [Forte/Moyenne/Faible]`
-3. Puis une ligne: `RÉSUMÉ: [Une phrase de synthèse]`
-4. Ensuite ton analyse détaillée
-
----
-
 ## 1. PROFIL DE L'ENTREPRISE
 - **Nom:** {company_name}
 - **Secteur:** {sector}
@@ -129,211 +348,144 @@ Tu es un analyste financier senior. Analyse les données suivantes et fournis un
 - **Consensus:** {recommendation}
 
 ## 4. INDICATEURS TECHNIQUES
-"""
+"""]
     
     # === INDICATEURS TECHNIQUES ===
     if indicators:
+        ig = indicators.get
         # RSI
-        rsi = indicators.get('rsi')
+        rsi = ig('rsi')
         if rsi is not None:
             rsi_signal = "SURACHETÉ ⚠️" if rsi > 70 else "SURVENDU ⚠️" if rsi < 30 else "Neutre"
-            prompt += f"- **RSI (14):** {rsi:.1f} → {rsi_signal}\n"
+            parts.append(f"- **RSI (14):** {rsi:.1f} → {rsi_signal}\n")
         
         # Moyennes mobiles
-        ma_20 = indicators.get('ma_20')
-        ma_50 = indicators.get('ma_50')
-        ma_200 = indicators.get('ma_200')
+        ma_20 = ig('ma_20')
+        ma_50 = ig('ma_50')
+        ma_200 = ig('ma_200')
         
         if ma_20:
-            ma20_pos = "AU-DESSUS ✅" if current_price > ma_20 else "EN-DESSOUS ❌"
-            prompt += f"- **MA20:** {ma_20:.2f}$ (Prix {ma20_pos})\n"
+            ma20_pos = _MA_POS[bool(current_price > ma_20)]
+            parts.append(f"- **MA20:** {ma_20:.2f}$ (Prix {ma20_pos})\n")
         if ma_50:
-            ma50_pos = "AU-DESSUS ✅" if current_price > ma_50 else "EN-DESSOUS ❌"
-            prompt += f"- **MA50:** {ma_50:.2f}$ (Prix {ma50_pos})\n"
+            ma50_pos = _MA_POS[bool(current_price > ma_50)]
+            parts.append(f"- **MA50:** {ma_50:.2f}$ (Prix {ma50_pos})\n")
         if ma_200:
-            ma200_pos = "AU-DESSUS ✅" if current_price > ma_200 else "EN-DESSOUS ❌"
-            prompt += f"- **MA200:** {ma200:.2f}$ (Prix {ma200_pos})\n"
+            ma200_pos = _MA_POS[bool(current_price > ma_200)]
+            parts.append(f"- **MA200:** {ma_200:.2f}$ (Prix {ma200_pos})\n")
         
         # MACD
-        macd = indicators.get('macd')
-        macd_signal = indicators.get('macd_signal')
-        macd_hist = indicators.get('macd_histogram')
+        macd = ig('macd')
+        macd_signal = ig('macd_signal')
+        macd_hist = ig('macd_histogram')
         if macd is not None and macd_signal is not None:
             macd_trend = "HAUSSIER ✅" if macd > macd_signal else "BAISSIER ❌"
-            prompt += f"- **MACD:** {macd:.3f} | Signal: {macd_signal:.3f} → {macd_trend}\n"
+            parts.append(f"- **MACD:** {macd:.3f} | Signal: {macd_signal:.3f} → {macd_trend}\n")
             if macd_hist is not None:
-                prompt += f"- **Histogramme MACD:** {macd_hist:.3f}\n"
+                parts.append(f"- **Histogramme MACD:** {macd_hist:.3f}\n")
         
         # Bandes de Bollinger
-        bb_upper = indicators.get('bb_upper')
-        bb_lower = indicators.get('bb_lower')
-        bb_position = indicators.get('bb_position')
+        bb_upper = ig('bb_upper')
+        bb_lower = ig('bb_lower')
+        bb_position = ig('bb_position')
         if bb_upper and bb_lower:
-            prompt += f"- **Bollinger:** [{bb_lower:.2f}$ - {bb_upper:.2f}$]\n"
+            parts.append(f"- **Bollinger:** [{bb_lower:.2f}$ - {bb_upper:.2f}$]\n")
             if bb_position is not None:
                 bb_zone = "HAUT (Surachat)" if bb_position > 80 else "BAS (Survente)" if bb_position < 20 else "Médian"
-                prompt += f"- **Position Bollinger:** {bb_position:.1f}% → {bb_zone}\n"
+                parts.append(f"- **Position Bollinger:** {bb_position:.1f}% → {bb_zone}\n")
         
         # Stochastique
-        stoch_k = indicators.get('stoch_k')
-        stoch_d = indicators.get('stoch_d')
+        stoch_k = ig('stoch_k')
+        stoch_d = ig('stoch_d')
         if stoch_k is not None and stoch_d is not None:
             stoch_signal = "SURACHETÉ" if stoch_k > 80 else "SURVENDU" if stoch_k < 20 else "Neutre"
-            prompt += f"- **Stochastique:** K={stoch_k:.1f} D={stoch_d:.1f} → {stoch_signal}\n"
+            parts.append(f"- **Stochastique:** K={stoch_k:.1f} D={stoch_d:.1f} → {stoch_signal}\n")
         
         # Volume
-        vol_ratio = indicators.get('volume_ratio')
+        vol_ratio = ig('volume_ratio')
         if vol_ratio is not None:
             vol_signal = "ÉLEVÉ 📈" if vol_ratio > 1.5 else "FAIBLE 📉" if vol_ratio < 0.5 else "Normal"
-            prompt += f"- **Ratio Volume:** {vol_ratio:.2f}x → {vol_signal}\n"
+            parts.append(f"- **Ratio Volume:** {vol_ratio:.2f}x → {vol_signal}\n")
         
         # ATR
-        atr = indicators.get('atr')
-        atr_pct = indicators.get('atr_percent')
+        atr = ig('atr')
+        atr_pct = ig('atr_percent')
         if atr is not None and atr_pct is not None:
             volatility = "HAUTE" if atr_pct > 3 else "FAIBLE" if atr_pct < 1 else "Modérée"
-            prompt += f"- **ATR:** {atr:.2f}$ ({atr_pct:.2f}%) → Volatilité {volatility}\n"
+            parts.append(f"- **ATR:** {atr:.2f}$ ({atr_pct:.2f}%) → Volatilité {volatility}\n")
         
         # Support/Résistance
-        support = indicators.get('support')
-        resistance = indicators.get('resistance')
+        support = ig('support')
+        resistance = ig('resistance')
         if support and resistance:
-            prompt += f"- **Support:** {support:.2f}$ | **Résistance:** {resistance:.2f}$\n"
+            parts.append(f"- **Support:** {support:.2f}$ | **Résistance:** {resistance:.2f}$\n")
             # Distance aux niveaux
             dist_support = ((current_price - support) / current_price) * 100
             dist_resistance = ((resistance - current_price) / current_price) * 100
-            prompt += f"- **Distance Support:** {dist_support:.1f}% | **Distance Résistance:** {dist_resistance:.1f}%\n"
+            parts.append(f"- **Distance Support:** {dist_support:.1f}% | **Distance Résistance:** {dist_resistance:.1f}%\n")
     
     # === MODE AVANCÉ ===
     if advanced:
         # Actualités
         if news and len(news) > 0:
-            prompt += "\n## 5. ACTUALITÉS RÉCENTES\n"
-            prompt += "Voici les dernières actualités concernant cette action:\n\n"
-            for i, article in enumerate(news[:5], 1):
-                title = article.get('title', article.get('headline', 'Sans titre'))
-                source = article.get('source', article.get('publisher', 'Source inconnue'))
-                summary = article.get('summary', '')[:200]
+            parts.append("\n## 5. ACTUALITÉS RÉCENTES\n")
+            parts.append("Voici les dernières actualités concernant cette action:\n\n")
+            for i, article in enumerate(islice(news, 5), 1):
+                title = _first(article, 'title', 'headline', default='Sans titre')
+                source = _first(article, 'source', 'publisher', default='Source inconnue')
+                summary = (article.get('summary') or '')[:200]
                 date = article.get('date', '')
                 
-                prompt += f"**{i}. {title}**\n"
-                prompt += f"   - Source: {source}"
-                if date:
-                    prompt += f" | Date: {date}"
-                prompt += "\n"
-                if summary:
-                    prompt += f"   - Résumé: {summary}...\n"
-                prompt += "\n"
+                date_line = f" | Date: {date}" if date else ""
+                summary_line = f"   - Résumé: {summary}...\n" if summary else ""
+                parts.append(f"**{i}. {title}**\n   - Source: {source}{date_line}\n{summary_line}\n")
             
-            prompt += """→ **Analyse l'impact des news:**
+            parts.append("""→ **Analyse l'impact des news:**
    - Sentiment global (Positif/Négatif/Neutre)
    - Catalyseurs potentiels identifiés
    - Risques médiatiques ou réputationnels
-"""
+""")
         
         # Calendrier financier
         if calendar is not None:
-            prompt += "\n## 6. CALENDRIER FINANCIER\n"
+            parts.append("\n## 6. CALENDRIER FINANCIER\n")
             try:
                 if hasattr(calendar, 'items'):
                     for key, value in calendar.items():
-                        prompt += f"- {key}: {value}\n"
+                        parts.append(f"- {key}: {value}\n")
                 elif hasattr(calendar, 'to_dict'):
                     cal_dict = calendar.to_dict()
                     for key, value in cal_dict.items():
-                        prompt += f"- {key}: {value}\n"
+                        parts.append(f"- {key}: {value}\n")
             except Exception:
-                prompt += "- Données calendrier non disponibles\n"
+                parts.append("- Données calendrier non disponibles\n")
         
         # Recommandations analystes
         if recommendations is not None:
-            prompt += "\n## 7. RECOMMANDATIONS ANALYSTES (5 dernières)\n"
+            parts.append("\n## 7. RECOMMANDATIONS ANALYSTES (5 dernières)\n")
             try:
                 if hasattr(recommendations, 'to_string'):
-                    prompt += recommendations.to_string() + "\n"
+                    parts.append(recommendations.to_string() + "\n")
                 else:
-                    prompt += str(recommendations) + "\n"
+                    parts.append(str(recommendations) + "\n")
             except Exception:
-                prompt += "- Données recommandations non disponibles\n"
+                parts.append("- Données recommandations non disponibles\n")
     
     # === INSTRUCTIONS FINALES - FORMAT JSON ===
-    prompt += f"""
----
-
-## CONSIGNES D'ANALYSE
-
-1. **Analyse technique:** Interprète les indicateurs de manière cohérente, identifie les divergences, les croisements de moyennes mobiles, et les patterns chartistes
-2. **Analyse fondamentale:** Évalue la valorisation par rapport au secteur et aux moyennes historiques. Compare les multiples (P/E, PEG) aux pairs
-3. **Catalyseurs:** Identifie les événements pouvant impacter le cours (earnings, annonces, M&A, macro)
-4. **Risques:** Liste les principaux risques à surveiller (sectoriels, macro, spécifiques à l'entreprise)
-5. **Niveaux clés:** Définis des points d'entrée/sortie précis basés sur support/résistance et ATR
-6. **Horizon temporel:** Distingue court terme (1-5 jours), moyen terme (1-3 mois), long terme (6+ mois)
-
-## FORMAT DE RÉPONSE - JSON OBLIGATOIRE
-
-Réponds UNIQUEMENT avec un objet JSON valide, sans texte avant ou après.
-Respecte EXACTEMENT ce schéma:
-
-```json
-{{
-  "signal": "ACHETER" | "VENDRE" | "CONSERVER",
-  "conviction": "Forte" | "Moyenne" | "Faible",
-  "resume": "Synthèse détaillée de 3-4 phrases: situation actuelle, facteurs clés, et recommandation avec horizon temporel",
-  "analyse_technique": {{
-    "tendance": "Haussière" | "Baissière" | "Neutre",
-    "tendance_details": "Description détaillée de la tendance avec les niveaux clés et la force du mouvement",
-    "rsi_interpretation": "Analyse complète du RSI: niveau actuel, zones de surachat/survente, divergences éventuelles",
-    "macd_interpretation": "Analyse du MACD: position par rapport au signal, momentum, croisements récents ou à venir",
-    "moyennes_mobiles": "Position du prix par rapport aux MA20/50/200, golden/death cross potentiels",
-    "volatilite": "Niveau ATR, implications pour le sizing de position et les stops",
-    "volumes": "Analyse des volumes: confirmation de tendance, divergences, accumulation/distribution",
-    "pattern": "Patterns chartistes identifiés (si présents): support, résistance, figures"
-  }},
-  "analyse_fondamentale": {{
-    "valorisation": "Évaluation détaillée: P/E vs historique et secteur, PEG ratio, valeur relative",
-    "qualite_entreprise": "Points sur la qualité du business: marges, croissance, avantages compétitifs",
-    "points_forts": ["Force 1 avec explication", "Force 2 avec explication", "Force 3"],
-    "points_faibles": ["Faiblesse 1 avec explication", "Faiblesse 2 avec explication"]
-  }},
-  "sentiment_marche": {{
-    "consensus_analystes": "Synthèse des recommandations analystes et objectifs de cours",
-    "news_impact": "Impact des actualités récentes sur le titre",
-    "flux_institutionnels": "Tendance des flux si disponible"
-  }},
-  "catalyseurs": [
-    {{"type": "positif", "horizon": "court/moyen/long terme", "description": "Description détaillée du catalyseur et son impact potentiel"}},
-    {{"type": "negatif", "horizon": "court/moyen/long terme", "description": "Description du risque et probabilité"}}
-  ],
-  "risques": {{
-    "risque_principal": "Le risque majeur à surveiller avec son déclencheur potentiel",
-    "risques_secondaires": ["Risque 2 avec contexte", "Risque 3 avec contexte"],
-    "stop_loss_justification": "Pourquoi ce niveau de stop est approprié"
-  }},
-  "niveaux": {{
-    "achat_recommande": {current_price:.2f},
-    "stop_loss": {current_price * 0.95:.2f},
-    "objectif_1": {current_price * 1.10:.2f},
-    "objectif_2": {current_price * 1.20:.2f},
-    "ratio_risk_reward": "Calcul du ratio risque/rendement",
-    "invalidation": "Niveau qui invaliderait le scénario"
-  }},
-  "plan_trading": {{
-    "entree": "Conditions idéales pour entrer en position",
-    "gestion": "Comment gérer la position (trailing stop, prise de profits partielle)",
-    "sortie": "Conditions de sortie autres que TP/SL"
-  }},
-  "conclusion": "Synthèse finale de 4-5 phrases: contexte actuel, opportunité ou risque principal, niveaux clés à surveiller, et recommandation claire avec conviction et horizon"
-}}
-```
-
-IMPORTANT:
-- Retourne UNIQUEMENT le JSON, pas de texte explicatif
-- Utilise des nombres pour les prix (pas de $)
-- Les niveaux doivent être réalistes par rapport au support/résistance
-- Chaque liste doit contenir au moins un élément
-"""
-    
-    return prompt
+    # Niveaux indicatifs proposés au modèle dans le schéma
+    entry = current_price
+    sl = current_price * STOP_LOSS_RATIO
+    tp1 = current_price * TARGET_1_RATIO
+    tp2 = current_price * TARGET_2_RATIO
+    parts.append(ANALYSIS_PROMPT_GUIDELINES)
+    parts.append(f"""    "achat_recommande": {entry:.2f},
+    "stop_loss": {sl:.2f},
+    "objectif_1": {tp1:.2f},
+    "objectif_2": {tp2:.2f},
+""")
+    parts.append(ANALYSIS_PROMPT_FOOTER)
+    
+    return ''.join(parts)
 
 
 def generate_analysis(ticker, model, context, num_threads=12):
@@ -353,49 +505,49 @@ def generate_analysis(ticker, model, context, num_threads=12):
     start_time = time.time()
     
     try:
+        messages = [
+            {
+                'role': 'system',
+                'content': SYSTEM_PROMPT_ANALYSIS
+            },
+            {
+                'role': 'user', 
+                'content': context
+            }
+        ]
+        
         # Configuration optimisée pour l'analyse financière avec sortie JSON
-        response = ollama.chat(
+        analysis_text, final_chunk = _chat_stream(
             model=model,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': """Tu es un analyste financier senior avec 20 ans d'expérience dans les marchés actions.
-Tu fournis des analyses approfondies, précises, factuelles et actionnables.
-Tu réponds UNIQUEMENT en JSON valide, sans texte avant ou après.
-Tu ne fais jamais de prédictions garanties mais donnes des probabilités et scénarios.
-Tu utilises un langage professionnel mais accessible en français.
-Tu justifies toujours tes recommandations avec des données chiffrées.
-Tu identifies les risques autant que les opportunités.
-Tu donnes des niveaux de prix précis pour l'entrée, le stop-loss et les objectifs."""
-                },
-                {
-                    'role': 'user', 
-                    'content': context
-                }
-            ],
+            messages=messages,
             format='json',  # Force la sortie JSON
             options={
                 'temperature': 0.3,      # Factuel et cohérent
                 'top_p': 0.9,            # Nucleus sampling
                 'top_k': 40,             # Limite le vocabulaire
                 'num_thread': num_threads,
-                'num_predict': 5000,     # Augmenté pour analyses détaillées
-                'repeat_penalty': 1.1,   # Évite les répétitions
+                'num_predict': ANALYSIS_NUM_PREDICT,
+                'repeat_last_n': 0,      # Pas de pénalité de répétition: la grammaire JSON cadre déjà la sortie
             }
         )
         
         elapsed_time = time.time() - start_time
-        analysis_text = response['message']['content']
+        _log_eval_count(ticker, final_chunk, ANALYSIS_NUM_PREDICT)
         
         # Validation basique de la réponse
         if not analysis_text or len(analysis_text) < 100:
             print(f"⚠️ Réponse trop courte de l'IA pour {ticker}")
             return None, 0
         
-        # Vérification du format attendu
-        if 'SIGNAL:' not in analysis_text.upper():
-            print(f"⚠️ Format de réponse non conforme pour {ticker}, tentative de correction...")
-            # On garde quand même la réponse mais on log le problème
+        # Vérification du format attendu: objet JSON avec un champ "signal"
+        try:
+            parsed = _json_loads(strip_code_fences(analysis_text))
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Réponse non-JSON valide pour {ticker}: {e}")
+            return None, 0
+        if not isinstance(parsed, dict) or 'signal' not in parsed:
+            print(f"⚠️ Champ 'signal' absent de la réponse pour {ticker}")
+            return None, 0
         
         return analysis_text, elapsed_time
         
@@ -440,7 +592,7 @@ CONVICTION: [Forte/Moyenne/Faible]
 RÉSUMÉ: [10 mots maximum]"""
 
     try:
-        response = ollama.chat(
+        response = _chat(
             model=model,
             messages=[{'role': 'user', 'content': prompt}],
             options={
@@ -494,7 +646,7 @@ Fournis:
 """
     
     try:
-        response = ollama.chat(
+        response = _chat(
             model=model,
             messages=[{'role': 'user', 'content': prompt}],
             options={
@@ -511,6 +663,24 @@ Fournis:
         return None
 
 
+# Section d'une position dans le prompt portefeuille (remplie via str.format)
+_POS_TEMPLATE = """
+### {i}. {ticker}
+- **Entrée:** {entry_price:.2f}$ le {entry_date}
+- **Prix actuel:** {current_price:.2f}$
+- **Quantité:** {quantity}
+- **P&L:** {pnl_value:+.2f}$ ({pnl_percent:+.2f}%)
+- **Stop-Loss:** {stop_loss}
+- **Take-Profit:** {take_profit}
+- **Signal AI récent:** {signal} (Conviction: {confidence})
+- **RSI:** {rsi} | **MACD Hist:** {macd_hist}
+- **Analyse récente:** {summary}...
+"""
+
+# Dict vide partagé pour les analyses/indicateurs absents (lecture seule)
+_EMPTY = {}
+
+
 def build_portfolio_analysis_prompt(positions, latest_analyses):
     """
     Construit le prompt pour l'analyse globale du portefeuille.
@@ -522,15 +692,22 @@ def build_portfolio_analysis_prompt(positions, latest_analyses):
     Returns:
         str: Prompt formaté pour l'analyse IA du portefeuille
     """
-    from datetime import datetime
-    
-    total_invested = sum(p.get('entry_price', 0) * p.get('quantity', 1) for p in positions)
-    total_value = sum(p.get('current_price', p.get('entry_price', 0)) * p.get('quantity', 1) for p in positions)
+    now = datetime.now()
+    
+    # Un seul passage sur les positions pour les deux totaux
+    total_invested = 0
+    total_value = 0
+    for p in positions:
+        entry_price = p.get('entry_price', 0)
+        quantity = p.get('quantity', 1)
+        total_invested += entry_price * quantity
+        total_value += p.get('current_price', entry_price) * quantity
     total_pnl = total_value - total_invested
     total_pnl_percent = (total_pnl / total_invested * 100) if total_invested > 0 else 0
     
-    prompt = f"""# ANALYSE DE PORTEFEUILLE - CONSEILS DU JOUR
-Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}
+    # Accumulation en liste puis un seul join (évite les += quadratiques)
+    parts = [f"""# ANALYSE DE PORTEFEUILLE - CONSEILS DU JOUR
+Date: {now.strftime('%Y-%m-%d %H:%M')}
 
 ## INSTRUCTIONS
 Tu es un gestionnaire de portefeuille senior. Analyse mon portefeuille actuel et fournis:
@@ -545,44 +722,43 @@ Tu es un gestionnaire de portefeuille senior. Analyse mon portefeuille actuel et
 - **Nombre de positions:** {len(positions)}
 
 ## MES POSITIONS ACTUELLES
-"""
+"""]
 
+    la_get = latest_analyses.get
     for i, pos in enumerate(positions, 1):
-        ticker = pos.get('ticker', 'N/A')
-        entry_price = pos.get('entry_price', 0)
-        current_price = pos.get('current_price', entry_price)
-        quantity = pos.get('quantity', 1)
-        pnl_value = pos.get('pnl_value', 0)
-        pnl_percent = pos.get('pnl_percent', 0)
-        stop_loss = pos.get('stop_loss')
-        take_profit_1 = pos.get('take_profit_1')
-        entry_date = pos.get('entry_date', '')
+        pg = pos.get
+        ticker = pg('ticker', 'N/A')
+        entry_price = pg('entry_price', 0)
+        stop_loss = pg('stop_loss')
+        take_profit_1 = pg('take_profit_1')
+        entry_date = pg('entry_date', '')
         
         # Récupérer l'analyse récente si disponible
-        analysis = latest_analyses.get(ticker, {})
-        signal = analysis.get('signal', 'N/A')
-        confidence = analysis.get('confidence', 'N/A')
-        summary = analysis.get('summary', '')[:200] if analysis.get('summary') else ''
+        analysis = la_get(ticker, _EMPTY)
+        ag = analysis.get
         
         # Indicateurs
-        indicators = analysis.get('indicators', {})
-        rsi = indicators.get('rsi', 'N/A')
-        macd_hist = indicators.get('macd_histogram', 'N/A')
+        indicators = ag('indicators', _EMPTY)
         
-        prompt += f"""
-### {i}. {ticker}
-- **Entrée:** {entry_price:.2f}$ le {entry_date[:10] if entry_date else 'N/A'}
-- **Prix actuel:** {current_price:.2f}$
-- **Quantité:** {quantity}
-- **P&L:** {pnl_value:+.2f}$ ({pnl_percent:+.2f}%)
-- **Stop-Loss:** {f'{stop_loss:.2f}$' if stop_loss else 'Non défini'}
-- **Take-Profit:** {f'{take_profit_1:.2f}$' if take_profit_1 else 'Non défini'}
-- **Signal AI récent:** {signal} (Conviction: {confidence})
-- **RSI:** {rsi} | **MACD Hist:** {macd_hist}
-- **Analyse récente:** {summary}...
-"""
-
-    prompt += f"""
+        parts.append(_POS_TEMPLATE.format(
+            i=i,
+            ticker=ticker,
+            entry_price=entry_price,
+            entry_date=entry_date[:10] if entry_date else 'N/A',
+            current_price=pg('current_price', entry_price),
+            quantity=pg('quantity', 1),
+            pnl_value=pg('pnl_value', 0),
+            pnl_percent=pg('pnl_percent', 0),
+            stop_loss=f'{stop_loss:.2f}$' if stop_loss else 'Non défini',
+            take_profit=f'{take_profit_1:.2f}$' if take_profit_1 else 'Non défini',
+            signal=ag('signal', 'N/A'),
+            confidence=ag('confidence', 'N/A'),
+            rsi=indicators.get('rsi', 'N/A'),
+            macd_hist=indicators.get('macd_histogram', 'N/A'),
+            summary=(ag('summary') or '')[:200],
+        ))
+
+    parts.append(f"""
 ---
 
 ## FORMAT DE RÉPONSE - JSON OBLIGATOIRE
@@ -592,7 +768,7 @@ Respecte EXACTEMENT ce schéma:
 
 ```json
 {{
-  "date": "{datetime.now().strftime('%Y-%m-%d')}",
+  "date": "{now.strftime('%Y-%m-%d')}",
   "resume_global": {{
     "etat_portfolio": "Sain | Attention | Critique",
     "tendance": "Haussière | Baissière | Mixte",
@@ -632,9 +808,9 @@ IMPORTANT:
 - Un conseil par position dans conseils_positions
 - Les conseils doivent être actionnables et précis
 - Priorise les actions selon l'urgence
-"""
+""")
     
-    return prompt
+    return ''.join(parts)
 
 
 def generate_portfolio_analysis(positions, latest_analyses, model, num_threads=12):
@@ -650,8 +826,6 @@ def generate_portfolio_analysis(positions, latest_analyses, model, num_threads=1
     Returns:
         tuple: (analyse_json, temps_écoulé) ou (None, 0) en cas d'erreur
     """
-    import json
-    
     if not positions:
         print("⚠️ Aucune position ouverte à analyser")
         return None, 0
@@ -662,59 +836,58 @@ def generate_portfolio_analysis(positions, latest_analyses, model, num_threads=1
     # Construire le prompt
     prompt = build_portfolio_analysis_prompt(positions, latest_analyses)
     
+    messages = [
+        {
+            'role': 'system',
+            'content': SYSTEM_PROMPT_PORTFOLIO
+        },
+        {
+            'role': 'user',
+            'content': prompt
+        }
+    ]
+    options = {
+        'temperature': 0.3,
+        'top_p': 0.9,
+        'num_thread': num_threads,
+        'num_predict': 3000,
+        'repeat_last_n': 0,
+    }
+    
     try:
-        response = ollama.chat(
-            model=model,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': """Tu es un gestionnaire de portefeuille expérimenté.
-Tu analyses les positions d'un investisseur et fournis des conseils actionnables.
-Tu réponds UNIQUEMENT en JSON valide, sans texte avant ou après.
-Tu priorises la gestion du risque et la préservation du capital.
-Tu donnes des conseils précis et justifiés pour chaque position.
-Tu identifies les opportunités d'optimisation du portefeuille."""
-                },
-                {
-                    'role': 'user',
-                    'content': prompt
-                }
-            ],
-            format='json',
-            options={
-                'temperature': 0.3,
-                'top_p': 0.9,
-                'num_thread': num_threads,
-                'num_predict': 3000,
-                'repeat_penalty': 1.1,
-            }
-        )
-        
-        elapsed_time = time.time() - start_time
-        analysis_text = response['message']['content']
-        
-        # Nettoyer les backticks markdown si présents
-        clean_text = analysis_text.strip()
-        if clean_text.startswith('```'):
-            # Extraire le contenu entre les backticks
-            lines = clean_text.split('\n')
-            # Retirer la première ligne (```json ou ```)
-            if lines[0].startswith('```'):
-                lines = lines[1:]
-            # Retirer la dernière ligne si c'est ```
-            if lines and lines[-1].strip() == '```':
-                lines = lines[:-1]
-            clean_text = '\n'.join(lines)
+        # Une relance déterministe si la première réponse n'est pas du JSON valide
+        for attempt in range(2):
+            analysis_text, final_chunk = _chat_stream(
+                model=model,
+                messages=messages,
+                format='json',
+                options=options
+            )
+            _log_eval_count('portefeuille', final_chunk, options['num_predict'])
+            
+            # Nettoyer les backticks markdown si présents
+            clean_text = strip_code_fences(analysis_text)
+            
+            # Validation JSON
+            try:
+                analysis_json = _json_loads(clean_text)
+                elapsed_time = time.time() - start_time
+                print(f"✅ Analyse portefeuille JSON valide reçue")
+                return analysis_json, elapsed_time
+            except json.JSONDecodeError as e:
+                print(f"⚠️ Réponse non-JSON valide: {e}")
+                print(f"   Réponse brute: {clean_text[:200]}...")
+            
+            if attempt == 0:
+                print(f"🔁 Nouvelle tentative (temperature=0, consigne JSON stricte)...")
+                messages = messages + [
+                    {'role': 'assistant', 'content': analysis_text},
+                    {'role': 'user', 'content': PORTFOLIO_JSON_RETRY_PROMPT}
+                ]
+                options = {**options, 'temperature': 0}
         
-        # Validation JSON
-        try:
-            analysis_json = json.loads(clean_text)
-            print(f"✅ Analyse portefeuille JSON valide reçue")
-            return analysis_json, elapsed_time
-        except json.JSONDecodeError as e:
-            print(f"⚠️ Réponse non-JSON valide: {e}")
-            print(f"   Réponse brute: {clean_text[:200]}...")
-            return {'raw_response': analysis_text, 'error': 'JSON parse failed'}, elapsed_time
+        print(f"❌ Analyse portefeuille: JSON invalide après relance")
+        return None, 0
             
     except Exception as e:
         print(f"❌ Erreur analyse portefeuille: {type(e).__name__}: {e}")
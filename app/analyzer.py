@@ -1,30 +1,51 @@
 """Script principal d'analyse financière - Version Enhanced avec Market Hours"""
-import os
-import json
+import queue
+import threading
+import traceback
+from collections import defaultdict
 from datetime import datetime, time as dtime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from types import MappingProxyType, SimpleNamespace
+from zoneinfo import ZoneInfo
 import time
-import yfinance as yf
-import pytz
 
-from config import load_config
-from data_fetcher import fetch_stock_data, fetch_enhanced_stock_data, calculate_variations
+from config import load_config, get_config_mtime
+from data_fetcher import fetch_enhanced_stock_data, calculate_variations
 from indicators import get_technical_indicators
-from ai_analysis import build_analysis_prompt, generate_analysis, generate_portfolio_analysis
+from ai_analysis import (
+    build_analysis_prompt, generate_analysis, generate_portfolio_analysis, OLLAMA_MAX_CONCURRENT
+)
 from signal_extractor import extract_signal_from_analysis, validate_signal, format_structured_analysis
 from database import (
-    save_analysis, init_db, save_all_news_summaries, get_last_analysis_times, 
+    save_analyses, save_all_news_summaries, get_last_analysis_times,
     get_last_batch_analysis_date, set_last_batch_analysis_date,
-    get_positions, get_latest_analyses, save_portfolio_analysis
+    get_open_positions_with_analyses, save_portfolio_analysis,
+    get_latest_news_summaries, get_latest_portfolio_analysis
 )
 
-# Import conditionnel news_fetcher
-try:
-    from news_fetcher import generate_news_summary
-    NEWS_AVAILABLE = True
-except ImportError:
-    NEWS_AVAILABLE = False
-    print("⚠️ News module non disponible")
+
+@lru_cache(maxsize=1)
+def _news_fetcher():
+    """
+    Import conditionnel et différé de news_fetcher (finnhub, session HTTP...):
+    les modes qui n'utilisent pas les news (--single, --check...) ne le chargent pas.
+    
+    Returns:
+        Le module news_fetcher, ou None s'il n'est pas disponible
+    """
+    try:
+        import news_fetcher
+        return news_fetcher
+    except ImportError:
+        print("⚠️ News module non disponible")
+        return None
+
+
+# Bandeaux de log (construits une fois)
+_BAR60 = '=' * 60
+_FIRE30 = '🔥' * 30
+_TARGET30 = '🎯' * 30
 
 
 # ============================================
@@ -35,7 +56,7 @@ MARKET_SCHEDULES = {
         'timezone': 'America/New_York',
         'open': dtime(9, 30),   # 9:30 AM ET
         'close': dtime(16, 0),   # 4:00 PM ET
-        'suffixes': ['', '.US'],  # No suffix or .US
+        'suffixes': ('', '.US'),  # No suffix or .US
         'name': 'NYSE/NASDAQ',
         'currency': 'USD',
         'currency_symbol': '$'
@@ -44,7 +65,7 @@ MARKET_SCHEDULES = {
         'timezone': 'Europe/Zurich',
         'open': dtime(9, 0),     # 9:00 AM CET
         'close': dtime(17, 30),  # 5:30 PM CET
-        'suffixes': ['.SW', '.VX'],
+        'suffixes': ('.SW', '.VX'),
         'name': 'SIX Swiss Exchange',
         'currency': 'CHF',
         'currency_symbol': 'CHF '
@@ -53,7 +74,7 @@ MARKET_SCHEDULES = {
         'timezone': 'Europe/Paris',
         'open': dtime(9, 0),
         'close': dtime(17, 30),
-        'suffixes': ['.PA', '.DE', '.AS'],
+        'suffixes': ('.PA', '.DE', '.AS'),
         'name': 'Euronext',
         'currency': 'EUR',
         'currency_symbol': '€'
@@ -62,73 +83,97 @@ MARKET_SCHEDULES = {
         'timezone': 'Europe/London',
         'open': dtime(8, 0),
         'close': dtime(16, 30),
-        'suffixes': ['.L'],
+        'suffixes': ('.L',),
         'name': 'London Stock Exchange',
         'currency': 'GBP',
         'currency_symbol': '£'
     }
 }
 
+# Table statique: figée en lecture seule, les caches (lru_cache) qui en dérivent restent valides
+MARKET_SCHEDULES = MappingProxyType({
+    market: MappingProxyType(config) for market, config in MARKET_SCHEDULES.items()
+})
+
+# Suffixe (en majuscules, point compris) -> marché
+_SUFFIX_TO_MARKET = {
+    suffix.upper(): market
+    for market, config in MARKET_SCHEDULES.items()
+    for suffix in config['suffixes']
+    if suffix
+}
 
-def get_ticker_currency(ticker):
-    """Retourne la devise d'une action basée sur son suffixe"""
-    market = get_ticker_market(ticker)
-    config = MARKET_SCHEDULES.get(market, MARKET_SCHEDULES['US'])
-    return {
+# Devise de chaque marché, construite une fois
+_CURRENCY_BY_MARKET = {
+    market: MappingProxyType({
         'currency': config.get('currency', 'USD'),
         'symbol': config.get('currency_symbol', '$')
-    }
+    })
+    for market, config in MARKET_SCHEDULES.items()
+}
+_DEFAULT_CURRENCY = _CURRENCY_BY_MARKET['US']
+
+# Fuseaux horaires résolus une seule fois (objets immuables, partageables)
+_ZURICH_TZ = ZoneInfo('Europe/Zurich')
+_MARKET_TZ = {market: ZoneInfo(config['timezone']) for market, config in MARKET_SCHEDULES.items()}
 
 
+def get_ticker_currency(ticker):
+    """Retourne la devise d'une action basée sur son suffixe (mapping partagé en lecture seule)"""
+    return _CURRENCY_BY_MARKET.get(get_ticker_market(ticker), _DEFAULT_CURRENCY)
+
+
+@lru_cache(maxsize=4096)
 def get_ticker_market(ticker):
-    """Détermine le marché d'une action basé sur son suffixe"""
-    ticker_upper = ticker.upper()
-    
-    for market, config in MARKET_SCHEDULES.items():
-        for suffix in config['suffixes']:
-            if suffix and ticker_upper.endswith(suffix.upper()):
-                return market
+    """Détermine le marché d'une action basé sur son suffixe (mémoïsé: MARKET_SCHEDULES est statique)"""
+    # Tous les suffixes connus commencent au dernier point: une seule recherche dans la table
+    dot = ticker.rfind('.')
+    if dot < 0:
+        return 'US'
     
     # Par défaut, considérer comme US si pas de suffixe spécial
-    return 'US'
+    return _SUFFIX_TO_MARKET.get(ticker[dot:].upper(), 'US')
 
 
 def categorize_tickers_by_market(tickers):
     """Catégorise les tickers par marché"""
-    by_market = {}
+    by_market = defaultdict(list)
+    market_of = get_ticker_market
     for ticker in tickers:
-        market = get_ticker_market(ticker)
-        if market not in by_market:
-            by_market[market] = []
-        by_market[market].append(ticker)
-    return by_market
+        by_market[market_of(ticker)].append(ticker)
+    return dict(by_market)
 
 
-def get_market_schedule_times(market):
-    """Retourne les heures d'analyse pour un marché en heure locale (Zurich)"""
-    config = MARKET_SCHEDULES.get(market)
-    if not config:
-        return []
-    
-    market_tz = pytz.timezone(config['timezone'])
-    zurich_tz = pytz.timezone('Europe/Zurich')
-    
-    # Créer datetime pour aujourd'hui avec les heures d'open/close
-    today = datetime.now(market_tz).date()
+@lru_cache(maxsize=64)
+def _schedule_for(market, date_iso):
+    """Heures d'open/close (Zurich) d'un marché pour une date donnée - une entrée par jour et marché"""
+    config = MARKET_SCHEDULES[market]
+    market_tz = _MARKET_TZ[market]
+    day = datetime.fromisoformat(date_iso).date()
     
     # Open time
-    open_dt = market_tz.localize(datetime.combine(today, config['open']))
-    open_zurich = open_dt.astimezone(zurich_tz)
+    open_dt = datetime.combine(day, config['open'], tzinfo=market_tz)
+    open_zurich = open_dt.astimezone(_ZURICH_TZ)
     
     # Close time
-    close_dt = market_tz.localize(datetime.combine(today, config['close']))
-    close_zurich = close_dt.astimezone(zurich_tz)
+    close_dt = datetime.combine(day, config['close'], tzinfo=market_tz)
+    close_zurich = close_dt.astimezone(_ZURICH_TZ)
     
-    # Retourner les heures en format HH:MM pour le scheduler
-    return [
+    # Heures en format HH:MM pour le scheduler
+    return (
         {'time': open_zurich.strftime('%H:%M'), 'event': 'open', 'market': market},
         {'time': close_zurich.strftime('%H:%M'), 'event': 'close', 'market': market}
-    ]
+    )
+
+
+def get_market_schedule_times(market):
+    """Retourne les heures d'analyse pour un marché en heure locale (Zurich)"""
+    if market not in MARKET_SCHEDULES:
+        return []
+    
+    # Le résultat ne change qu'avec la date locale du marché (DST)
+    today = datetime.now(_MARKET_TZ[market]).date().isoformat()
+    return [dict(event) for event in _schedule_for(market, today)]
 
 
 def is_market_day():
@@ -136,14 +181,120 @@ def is_market_day():
     return datetime.now().weekday() < 5
 
 
-def analyze_stock(ticker, model, advanced=False, num_threads=12):
-    """Analyse une action avec les données enrichies et génère des conseils"""
-    print(f"\n{'='*60}")
-    print(f"📊 Analyse ENHANCED de {ticker} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"{'='*60}\n")
+# ============================================
+# LIMITATION DE DÉBIT
+# ============================================
+class TokenBucket:
+    """
+    Limiteur de débit à jetons (thread-safe): n'attend que si le quota est épuisé,
+    contrairement à un sleep fixe payé même quand l'appel précédent a été long.
+    """
+    
+    def __init__(self, rate, capacity=1):
+        """
+        Args:
+            rate: Jetons regagnés par seconde (None = pas de limite)
+            capacity: Nombre maximum de jetons accumulés (rafale autorisée)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, n=1):
+        """Consomme n jetons, en attendant le temps nécessaire si le seau est vide"""
+        with self._lock:
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            wait = (n - self.tokens) / self.rate if self.tokens < n else 0
+            # Jetons réservés dès maintenant: les autres threads attendent leur tour
+            self.tokens -= n
+        if wait > 0:
+            time.sleep(wait)
+    
+    def set_interval(self, seconds):
+        """Règle l'intervalle minimum entre deux jetons (0 = pas de limite)"""
+        with self._lock:
+            self.rate = 1.0 / seconds if seconds > 0 else None
+
+
+# Workers d'analyse parallèle par défaut (config: analysis_workers): les appels IA sont
+# bornés par les slots Ollama, un worker de plus récupère les données pendant que les autres attendent le modèle
+ANALYSIS_WORKERS = OLLAMA_MAX_CONCURRENT + 1
+
+# Intervalle minimum par défaut entre deux récupérations Yahoo Finance (config: yahoo_min_interval)
+YAHOO_MIN_INTERVAL = 1.0
+
+# Au plus une récupération Yahoo Finance par intervalle (remplace le sleep(1) entre actions)
+_YAHOO_BUCKET = TokenBucket(rate=1.0 / YAHOO_MIN_INTERVAL)
+
+
+# ============================================
+# SAUVEGARDE DB EN ARRIÈRE-PLAN
+# ============================================
+# Un seul thread écrivain: les workers d'analyse ne se disputent plus le verrou
+# SQLite et les analyses terminées ensemble partagent une transaction
+_SAVE_QUEUE = queue.Queue()
+_SAVE_BATCH_SIZE = 32
+_save_thread = None
+_save_thread_lock = threading.Lock()
+
 
+def _save_worker():
+    """Vide la file de sauvegarde par lots (une transaction par lot)"""
+    while True:
+        batch = [_SAVE_QUEUE.get()]
+        while len(batch) < _SAVE_BATCH_SIZE:
+            try:
+                batch.append(_SAVE_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            saved = save_analyses(batch)
+            if saved < len(batch):
+                print(f"⚠️ Échec sauvegarde DB pour {len(batch) - saved}/{len(batch)} analyse(s)")
+        except Exception as e:
+            print(f"❌ Erreur thread de sauvegarde DB: {e}")
+        finally:
+            for _ in batch:
+                _SAVE_QUEUE.task_done()
+
+
+def _queue_save(result):
+    """Met une analyse en file de sauvegarde (démarre le thread écrivain si besoin)"""
+    global _save_thread
+    with _save_thread_lock:
+        if _save_thread is None:
+            _save_thread = threading.Thread(target=_save_worker, name='db-writer', daemon=True)
+            _save_thread.start()
+    _SAVE_QUEUE.put(result)
+
+
+def flush_saves():
+    """Attend que toutes les analyses en file soient écrites en base"""
+    _SAVE_QUEUE.join()
+
+
+def prepare_stock_analysis(ticker, advanced=False):
+    """
+    Récupère les données d'une action et construit son prompt (sans appel IA).
+    Séparé de analyze_stock pour pouvoir préparer l'action suivante pendant
+    que le modèle analyse la courante.
+    
+    Args:
+        ticker: Symbole de l'action
+        advanced: Mode avancé avec news/calendar
+    
+    Returns:
+        dict: Données préparées (historiques, news, indicateurs, prompt) ou None en cas d'erreur
+    """
     try:
-        # 1. Récupérer les données enrichies
+        # 1. Récupérer les données enrichies (débit Yahoo limité, attente seulement si nécessaire)
+        _YAHOO_BUCKET.acquire()
         enhanced_data = fetch_enhanced_stock_data(ticker)
         if not enhanced_data:
             print(f"⚠️ Impossible de récupérer les données enrichies pour {ticker}")
@@ -151,14 +302,9 @@ def analyze_stock(ticker, model, advanced=False, num_threads=12):
 
         hist_1mo, analysis_data, actions = enhanced_data
 
-        # 2. Récupérer les données standard (CORRECTION: décompacter le tuple correctement)
-        stock_data = fetch_stock_data(ticker)
-        if not stock_data:
-            print(f"⚠️ Impossible de récupérer les données pour {ticker}")
-            return None
-
-        # CORRECTION: fetch_stock_data retourne (hist_5d, hist_1mo, hist_3mo, info)
-        hist_5d, hist_1mo_standard, hist_3mo, info_standard = stock_data
+        # 2. Dernières séances pour la variation 1 jour: dérivées de l'historique
+        # journalier déjà récupéré (6 points = 5 variations), sans second appel Yahoo
+        hist_5d = hist_1mo.tail(6)
 
         # Extraction des composants du dictionnaire pour plus de clarté
         info = analysis_data.get("info", {})
@@ -181,6 +327,40 @@ def analyze_stock(ticker, model, advanced=False, num_threads=12):
             recommendations=recos
         )
 
+        return {
+            'hist_1mo': hist_1mo,
+            'hist_5d': hist_5d,
+            'news': news,
+            'indicators': indicators,
+            'context': context
+        }
+
+    except Exception as e:
+        print(f"❌ Erreur lors de la préparation de {ticker}: {e}")
+        traceback.print_exc()
+        return None
+
+
+def analyze_stock(ticker, model, advanced=False, num_threads=12, prepared=None):
+    """Analyse une action avec les données enrichies et génère des conseils"""
+    now = datetime.now()
+    print(f"\n{_BAR60}")
+    print(f"📊 Analyse ENHANCED de {ticker} - {now.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"{_BAR60}\n")
+
+    try:
+        # 1-4. Données et prompt (éventuellement déjà préparés en arrière-plan)
+        if prepared is None:
+            prepared = prepare_stock_analysis(ticker, advanced)
+            if not prepared:
+                return None
+
+        hist_1mo = prepared['hist_1mo']
+        hist_5d = prepared['hist_5d']
+        news = prepared['news']
+        indicators = prepared['indicators']
+        context = prepared['context']
+
         # 5. Générer l'analyse IA
         analysis_text, elapsed_time = generate_analysis(ticker, model, context, num_threads)
 
@@ -206,14 +386,14 @@ def analyze_stock(ticker, model, advanced=False, num_threads=12):
         print(f"🎯 Signal: {signal_info['signal']} (Conviction: {signal_info['confidence']})")
         print(f"💡 Résumé: {signal_info['summary']}")
 
-        # 8. Calculer variations (CORRECTION: utiliser hist_5d correctement décompacté)
+        # 8. Calculer variations
         var_1d, var_1mo = calculate_variations(hist_5d, hist_1mo)
 
         # Debug: afficher les variations calculées
         print(f"📈 Variation 1j: {var_1d:.2f}% | Variation 1m: {var_1mo:.2f}%")
 
         # 9. Récupérer le prix actuel
-        current_price = float(hist_1mo['Close'].iloc[-1]) if not hist_1mo.empty else 0
+        current_price = float(hist_1mo['Close'].to_numpy()[-1]) if not hist_1mo.empty else 0
         
         # 9b. Récupérer la devise
         currency_info = get_ticker_currency(ticker)
@@ -221,7 +401,7 @@ def analyze_stock(ticker, model, advanced=False, num_threads=12):
         # 10. Sauvegarder les résultats complets
         result = {
             'ticker': ticker,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
             'price': current_price,
             'currency': currency_info['currency'],
             'currency_symbol': currency_info['symbol'],
@@ -239,18 +419,13 @@ def analyze_stock(ticker, model, advanced=False, num_threads=12):
             'raw_response': analysis_text  # Réponse brute pour debug
         }
 
-        # Sauvegarder en base de données SQLite
-        saved = save_analysis(result)
-        if saved:
-            print(f"💾 Sauvegardé en DB: {ticker} (ID: {saved.id})")
-        else:
-            print(f"⚠️ Échec sauvegarde DB pour {ticker}")
+        # Sauvegarder en base de données SQLite (écriture groupée en arrière-plan)
+        _queue_save(result)
 
         return result
 
     except Exception as e:
         print(f"❌ Erreur lors de l'analyse de {ticker}: {e}")
-        import traceback
         traceback.print_exc()
         return None
 
@@ -263,13 +438,13 @@ def update_news_summaries(force: bool = False):
     Args:
         force: Si True, force la régénération même si récent
     """
-    if not NEWS_AVAILABLE:
+    news_fetcher = _news_fetcher()
+    if news_fetcher is None:
         print("⚠️ News module non disponible, skip résumés")
         return
     
     # Smart scheduling: skip si déjà généré aujourd'hui
     if not force:
-        from database import get_latest_news_summaries
         recent = get_latest_news_summaries(max_age_minutes=1440)  # 24h max pour récupérer
         if recent.get('success') and recent.get('summaries'):
             generated_at = recent.get('generated_at', '')
@@ -283,11 +458,12 @@ def update_news_summaries(force: bool = False):
     
     start_time = time.time()
     start_datetime = datetime.now()
+    start_str = start_datetime.strftime('%Y-%m-%d %H:%M:%S')
     
-    print(f"\n{'='*60}")
+    print(f"\n{_BAR60}")
     print(f"📰 GÉNÉRATION DES RÉSUMÉS D'ACTUALITÉS")
-    print(f"🕐 Début: {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"{'='*60}")
+    print(f"🕐 Début: {start_str}")
+    print(f"{_BAR60}")
     
     config = load_config()
     tickers = config.get('tickers', [])
@@ -298,7 +474,7 @@ def update_news_summaries(force: bool = False):
     
     try:
         # Générer les résumés via le news_fetcher
-        result = generate_news_summary(tickers, category='all')
+        result = news_fetcher.generate_news_summary(tickers, category='all')
         
         if result.get('success') and result.get('summaries'):
             # Sauvegarder en DB
@@ -306,31 +482,50 @@ def update_news_summaries(force: bool = False):
             elapsed = time.time() - start_time
             end_datetime = datetime.now()
             
-            print(f"\n{'='*60}")
+            print(f"\n{_BAR60}")
             print(f"📰 RÉCAP NEWS FETCHER")
-            print(f"{'='*60}")
-            print(f"🕐 Début:    {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"{_BAR60}")
+            print(f"🕐 Début:    {start_str}")
             print(f"🕐 Fin:      {end_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
             print(f"⏱️  Durée:    {elapsed:.1f}s")
             print(f"📊 Résumés:  {count} catégories générées")
-            print(f"{'='*60}\n")
+            print(f"{_BAR60}\n")
         else:
             print(f"⚠️ Échec génération résumés: {result.get('error', 'Unknown error')}")
             
     except Exception as e:
         print(f"❌ Erreur update_news_summaries: {e}")
-        import traceback
         traceback.print_exc()
 
 
+def _analysis_policy(config):
+    """
+    Paramètres d'analyse lus une seule fois depuis la configuration
+    
+    Args:
+        config: Configuration chargée (load_config)
+    
+    Returns:
+        SimpleNamespace: model, advanced, parallel, num_threads, yahoo_min_interval, workers
+    """
+    return SimpleNamespace(
+        model=config.get('model', 'mistral-nemo'),
+        advanced=config.get('advanced_analysis', False),
+        parallel=config.get('parallel_analysis', False),
+        num_threads=config.get('num_threads', 12),
+        # rate_limit=False désactive le limiteur Yahoo (intervalle 0)
+        yahoo_min_interval=(
+            float(config.get('yahoo_min_interval', YAHOO_MIN_INTERVAL)) if config.get('rate_limit', True) else 0.0
+        ),
+        workers=max(1, int(config.get('analysis_workers', ANALYSIS_WORKERS)))
+    )
+
+
 def run_analysis(market_filter=None):
     """Lance l'analyse sur les actions configurées (filtrées par marché si spécifié)"""
     config = load_config()
     tickers = config.get('tickers', [])
-    model = config.get('model', 'mistral-nemo')
-    advanced = config.get('advanced_analysis', False)
-    parallel = config.get('parallel_analysis', False)
-    num_threads = config.get('num_threads', 12)
+    policy = _analysis_policy(config)
 
     if not tickers:
         print("⚠️ Aucune action configurée dans config.json")
@@ -338,6 +533,7 @@ def run_analysis(market_filter=None):
 
     start_total = time.time()
     start_datetime = datetime.now()
+    start_str = start_datetime.strftime('%Y-%m-%d %H:%M:%S')
     
     # Filtrer par marché si spécifié
     if market_filter:
@@ -347,49 +543,57 @@ def run_analysis(market_filter=None):
             print(f"⚠️ Aucune action pour le marché {market_filter}")
             return
         market_name = MARKET_SCHEDULES.get(market_filter, {}).get('name', market_filter)
-        print(f"\n{'🔥'*30}")
+        print(f"\n{_FIRE30}")
         print(f"🏛️ Analyse pour {market_name}")
         print(f"🔄 Démarrage de l'analyse pour {len(tickers)} action(s): {', '.join(tickers)}")
     else:
-        print(f"\n{'🔥'*30}")
+        print(f"\n{_FIRE30}")
         print(f"🔄 Démarrage de l'analyse ENHANCED pour {len(tickers)} action(s)")
     
-    print(f"🕐 Début: {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"📊 Mode: {'Approfondi (+News/Calendar)' if advanced else 'Standard'}")
-    print(f"⚡ Parallélisme: {'Activé' if parallel else 'Désactivé'}")
-    print(f"{'🔥'*30}\n")
+    print(f"🕐 Début: {start_str}")
+    print(f"📊 Mode: {'Approfondi (+News/Calendar)' if policy.advanced else 'Standard'}")
+    print(f"⚡ Parallélisme: {'Activé' if policy.parallel else 'Désactivé'}")
+    print(f"{_FIRE30}\n")
 
     analysis_count = 0
     successful_count = 0
+    _YAHOO_BUCKET.set_interval(policy.yahoo_min_interval)
     
-    if parallel and len(tickers) > 1:
-        with ThreadPoolExecutor(max_workers=min(4, len(tickers))) as executor:
-            futures = [executor.submit(analyze_stock, t, model, advanced, num_threads) for t in tickers]
-            for future in futures:
+    if policy.parallel and len(tickers) > 1:
+        with ThreadPoolExecutor(max_workers=min(policy.workers, len(tickers))) as executor:
+            futures = {executor.submit(analyze_stock, t, policy.model, policy.advanced, policy.num_threads): t for t in tickers}
+            for future in as_completed(futures):
                 result = future.result()
                 analysis_count += 1
                 if result:
                     successful_count += 1
+                print(f"{'✅' if result else '❌'} [{analysis_count}/{len(tickers)}] {futures[future]} terminé")
     else:
-        for ticker in tickers:
-            result = analyze_stock(ticker, model, advanced, num_threads)
-            analysis_count += 1
-            if result:
-                successful_count += 1
-            time.sleep(1)
+        # Préparation (fetch + prompt) de l'action suivante pendant l'appel IA en cours
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            next_prepared = prefetch.submit(prepare_stock_analysis, tickers[0], policy.advanced)
+            for i, ticker in enumerate(tickers):
+                prepared = next_prepared.result()
+                if i + 1 < len(tickers):
+                    next_prepared = prefetch.submit(prepare_stock_analysis, tickers[i + 1], policy.advanced)
+                result = analyze_stock(ticker, policy.model, policy.advanced, policy.num_threads, prepared=prepared) if prepared else None
+                analysis_count += 1
+                if result:
+                    successful_count += 1
 
+    flush_saves()
     total_time = time.time() - start_total
     end_datetime = datetime.now()
     
-    print(f"\n{'='*60}")
+    print(f"\n{_BAR60}")
     print(f"🤖 RÉCAP AI ANALYZER")
-    print(f"{'='*60}")
-    print(f"🕐 Début:      {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"{_BAR60}")
+    print(f"🕐 Début:      {start_str}")
     print(f"🕐 Fin:        {end_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"⏱️  Durée:      {total_time:.1f}s ({total_time/60:.1f} min)")
     print(f"📊 Analyses:   {successful_count}/{analysis_count} réussies")
     print(f"📈 Actions:    {', '.join(tickers)}")
-    print(f"{'='*60}\n")
+    print(f"{_BAR60}\n")
 
 
 def create_market_job(market):
@@ -406,16 +610,15 @@ def create_market_job(market):
 def run_single_analysis(ticker):
     """Run analysis on a single ticker (for on-demand requests)"""
     config = load_config()
-    model = config.get('model', 'mistral-nemo')
-    advanced = config.get('advanced_analysis', False)
-    num_threads = config.get('num_threads', 12)
+    policy = _analysis_policy(config)
     
-    print(f"\n{'🎯'*30}")
+    print(f"\n{_TARGET30}")
     print(f"🎯 ON-DEMAND ANALYSIS: {ticker}")
-    print(f"{'🎯'*30}\n")
+    print(f"{_TARGET30}\n")
     
     start_time = time.time()
-    result = analyze_stock(ticker, model, advanced, num_threads)
+    result = analyze_stock(ticker, policy.model, policy.advanced, policy.num_threads)
+    flush_saves()
     elapsed = time.time() - start_time
     
     if result:
@@ -430,21 +633,14 @@ def run_single_analysis(ticker):
 # SMART SCHEDULING FUNCTIONS
 # ============================================
 
+# Sentinel to tell "not provided" apart from None (never analyzed)
+_UNSET = object()
+
 # Track last known tickers for new ticker detection
 _last_known_tickers = set()
 _config_file_mtime = 0
 
 
-def get_config_mtime():
-    """Get modification time of config file"""
-    import os
-    config_path = '/app/config.json'
-    try:
-        return os.path.getmtime(config_path)
-    except:
-        return 0
-
-
 def check_for_new_tickers():
     """
     Check if new tickers were added to config.
@@ -460,6 +656,10 @@ def check_for_new_tickers():
     config = load_config()
     current_tickers = set(config.get('tickers', []))
     
+    # Config touched without changing the ticker list (model, threads...): nothing to diff
+    if current_tickers == _last_known_tickers:
+        return []
+    
     if not _last_known_tickers:
         # First run, initialize without triggering analysis
         _last_known_tickers = current_tickers
@@ -474,16 +674,22 @@ def check_for_new_tickers():
     return list(new_tickers)
 
 
-def should_run_daily_analysis():
+def should_run_daily_analysis(last_batch_date=_UNSET, today=None):
     """
     Check if daily analysis should run based on the last batch analysis DATE.
     Uses date comparison (not hours) to avoid issues with long-running analyses.
     
+    Args:
+        last_batch_date: Date already read from the DB (read here if omitted)
+        today: Today's date as YYYY-MM-DD (computed here if omitted)
+    
     Returns:
         (should_run: bool, reason: str)
     """
-    today = datetime.now().strftime('%Y-%m-%d')
-    last_batch_date = get_last_batch_analysis_date()
+    if today is None:
+        today = datetime.now().strftime('%Y-%m-%d')
+    if last_batch_date is _UNSET:
+        last_batch_date = get_last_batch_analysis_date()
     
     if last_batch_date is None:
         return True, "Première analyse (jamais exécutée)"
@@ -511,13 +717,8 @@ def get_tickers_needing_analysis():
     # Get last analysis times from DB
     last_analysis_times = get_last_analysis_times(tickers)
     
-    tickers_needing_analysis = []
-    
-    for ticker in tickers:
-        if ticker not in last_analysis_times or last_analysis_times.get(ticker) is None:
-            tickers_needing_analysis.append(ticker)
-    
-    return tickers_needing_analysis
+    # Missing or None both mean never analyzed: one .get() covers both
+    return [ticker for ticker in tickers if last_analysis_times.get(ticker) is None]
 
 
 def run_smart_analysis(force=False, on_startup=False):
@@ -536,11 +737,12 @@ def run_smart_analysis(force=False, on_startup=False):
         run_analysis()
         return
     
-    should_run, reason = should_run_daily_analysis()
+    last_batch_date = get_last_batch_analysis_date()
+    should_run, reason = should_run_daily_analysis(last_batch_date, today)
     
     print(f"\n📅 Vérification de l'analyse quotidienne:")
     print(f"   📆 Date du jour: {today}")
-    print(f"   📋 Dernière analyse batch: {get_last_batch_analysis_date() or 'Jamais'}")
+    print(f"   📋 Dernière analyse batch: {last_batch_date or 'Jamais'}")
     print(f"   {'✅' if should_run else '⏸️'} {reason}")
     
     if should_run:
@@ -567,67 +769,84 @@ def run_smart_analysis(force=False, on_startup=False):
 
 
 def run_analysis_for_tickers(tickers):
-    """Run analysis for a specific list of tickers"""
+    """Run analysis for a specific list of tickers (skipping those already analyzed today)"""
     if not tickers:
         return
     
+    # Stale triggers (e.g. a ticker handled since it was detected): no LLM call for today's analyses
+    today = datetime.now().date()
+    last_analysis_times = get_last_analysis_times(tickers)
+    done_today = {t for t, ts in last_analysis_times.items() if ts and ts.date() == today}
+    if done_today:
+        print(f"⏸️ Déjà analysés aujourd'hui: {', '.join(sorted(done_today))}")
+        tickers = [t for t in tickers if t not in done_today]
+        if not tickers:
+            return
+    
     config = load_config()
-    model = config.get('model', 'mistral-nemo')
-    advanced = config.get('advanced_analysis', False)
-    parallel = config.get('parallel_analysis', False)
-    num_threads = config.get('num_threads', 12)
+    policy = _analysis_policy(config)
 
     start_total = time.time()
     start_datetime = datetime.now()
+    start_str = start_datetime.strftime('%Y-%m-%d %H:%M:%S')
     
-    print(f"\n{'🔥'*30}")
+    print(f"\n{_FIRE30}")
     print(f"🔄 Analyse pour {len(tickers)} action(s): {', '.join(tickers)}")
-    print(f"🕐 Début: {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"📊 Mode: {'Approfondi (+News/Calendar)' if advanced else 'Standard'}")
-    print(f"⚡ Parallélisme: {'Activé' if parallel else 'Désactivé'}")
-    print(f"{'🔥'*30}\n")
+    print(f"🕐 Début: {start_str}")
+    print(f"📊 Mode: {'Approfondi (+News/Calendar)' if policy.advanced else 'Standard'}")
+    print(f"⚡ Parallélisme: {'Activé' if policy.parallel else 'Désactivé'}")
+    print(f"{_FIRE30}\n")
 
     analysis_count = 0
     successful_count = 0
+    _YAHOO_BUCKET.set_interval(policy.yahoo_min_interval)
     
-    if parallel and len(tickers) > 1:
-        with ThreadPoolExecutor(max_workers=min(4, len(tickers))) as executor:
-            futures = [executor.submit(analyze_stock, t, model, advanced, num_threads) for t in tickers]
-            for future in futures:
+    if policy.parallel and len(tickers) > 1:
+        with ThreadPoolExecutor(max_workers=min(policy.workers, len(tickers))) as executor:
+            futures = {executor.submit(analyze_stock, t, policy.model, policy.advanced, policy.num_threads): t for t in tickers}
+            for future in as_completed(futures):
                 result = future.result()
                 analysis_count += 1
                 if result:
                     successful_count += 1
+                print(f"{'✅' if result else '❌'} [{analysis_count}/{len(tickers)}] {futures[future]} terminé")
     else:
-        for ticker in tickers:
-            result = analyze_stock(ticker, model, advanced, num_threads)
-            analysis_count += 1
-            if result:
-                successful_count += 1
-            time.sleep(1)
+        # Préparation (fetch + prompt) de l'action suivante pendant l'appel IA en cours
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            next_prepared = prefetch.submit(prepare_stock_analysis, tickers[0], policy.advanced)
+            for i, ticker in enumerate(tickers):
+                prepared = next_prepared.result()
+                if i + 1 < len(tickers):
+                    next_prepared = prefetch.submit(prepare_stock_analysis, tickers[i + 1], policy.advanced)
+                result = analyze_stock(ticker, policy.model, policy.advanced, policy.num_threads, prepared=prepared) if prepared else None
+                analysis_count += 1
+                if result:
+                    successful_count += 1
 
+    flush_saves()
     total_time = time.time() - start_total
     end_datetime = datetime.now()
     
-    print(f"\n{'='*60}")
+    print(f"\n{_BAR60}")
     print(f"🤖 RÉCAP AI ANALYZER")
-    print(f"{'='*60}")
-    print(f"🕐 Début:      {start_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"{_BAR60}")
+    print(f"🕐 Début:      {start_str}")
     print(f"🕐 Fin:        {end_datetime.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"⏱️  Durée:      {total_time:.1f}s ({total_time/60:.1f} min)")
     print(f"📊 Analyses:   {successful_count}/{analysis_count} réussies")
     print(f"📈 Actions:    {', '.join(tickers)}")
-    print(f"{'='*60}\n")
+    print(f"{_BAR60}\n")
 
 
 def nightly_job():
     """Job pour l'analyse quotidienne nocturne à 3h du matin"""
-    print(f"\n{'='*60}")
+    print(f"\n{_BAR60}")
     print(f"🌙 ANALYSE NOCTURNE - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"{'='*60}")
+    print(f"{_BAR60}")
     
     # 1. D'abord générer les résumés d'actualités
-    if NEWS_AVAILABLE:
+    # (séquentiel: les résumés passent par leur propre session HTTP, hors du sémaphore Ollama)
+    if _news_fetcher():
         print("\n📰 Génération des résumés d'actualités...")
         update_news_summaries()
     
@@ -650,7 +869,6 @@ def run_portfolio_analysis(force: bool = False):
     """
     # Smart scheduling: skip si déjà généré aujourd'hui
     if not force:
-        from database import get_latest_portfolio_analysis
         recent = get_latest_portfolio_analysis()
         if recent:
             analysis_date = datetime.fromisoformat(recent['date']) if isinstance(recent['date'], str) else recent['date']
@@ -659,27 +877,22 @@ def run_portfolio_analysis(force: bool = False):
                 print(f"💼 Analyse portfolio déjà générée aujourd'hui ({recent['date']}) - skip")
                 return None
     
-    print(f"\n{'='*60}")
+    print(f"\n{_BAR60}")
     print(f"💼 ANALYSE AI DU PORTEFEUILLE")
     print(f"🕐 Début: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"{'='*60}\n")
+    print(f"{_BAR60}\n")
     
     start_time = time.time()
     
     try:
-        # 1. Récupérer les positions ouvertes
-        positions = get_positions(status='open')
+        # 1-2. Positions ouvertes et dernière analyse de chaque ticker (une seule session DB)
+        positions, latest_analyses = get_open_positions_with_analyses()
         
         if not positions:
             print("⚠️ Aucune position ouverte - pas d'analyse portefeuille")
             return None
         
         print(f"📊 {len(positions)} positions ouvertes à analyser")
-        
-        # 2. Récupérer les dernières analyses pour chaque ticker
-        tickers = list(set(p['ticker'] for p in positions))
-        latest_analyses = get_latest_analyses(tickers)
-        
         print(f"📈 Analyses récentes disponibles pour {len(latest_analyses)} tickers")
         
         # 3. Configuration
@@ -700,7 +913,7 @@ def run_portfolio_analysis(force: bool = False):
             return None
         
         # 5. Sauvegarder en DB
-        saved = save_portfolio_analysis(
+        save_portfolio_analysis(
             analysis_data=analysis_result,
             model=model,
             elapsed_time=elapsed_time,
@@ -710,44 +923,46 @@ def run_portfolio_analysis(force: bool = False):
         # 6. Afficher le résumé
         total_time = time.time() - start_time
         
-        print(f"\n{'='*60}")
-        print(f"💼 RÉCAP ANALYSE PORTEFEUILLE")
-        print(f"{'='*60}")
-        print(f"⏱️  Durée:      {total_time:.1f}s")
-        print(f"📊 Positions:  {len(positions)}")
+        # Récap construit en entier puis écrit en un seul print (une trame de log)
+        lines = [
+            f"\n{_BAR60}",
+            f"💼 RÉCAP ANALYSE PORTEFEUILLE",
+            f"{_BAR60}",
+            f"⏱️  Durée:      {total_time:.1f}s",
+            f"📊 Positions:  {len(positions)}",
+        ]
         
         if analysis_result and 'resume_global' in analysis_result:
             resume = analysis_result['resume_global']
-            print(f"🏥 État:       {resume.get('etat_portfolio', 'N/A')}")
-            print(f"📈 Tendance:   {resume.get('tendance', 'N/A')}")
-            print(f"💯 Score:      {resume.get('score_sante', 'N/A')}/100")
+            lines.append(f"🏥 État:       {resume.get('etat_portfolio', 'N/A')}")
+            lines.append(f"📈 Tendance:   {resume.get('tendance', 'N/A')}")
+            lines.append(f"💯 Score:      {resume.get('score_sante', 'N/A')}/100")
             
             # Actions prioritaires
             actions = analysis_result.get('actions_du_jour', {})
             high_priority = actions.get('priorite_haute', [])
             if high_priority:
-                print(f"\n🚨 ACTIONS PRIORITAIRES:")
-                for action in high_priority[:3]:
-                    print(f"   → {action}")
+                lines.append(f"\n🚨 ACTIONS PRIORITAIRES:")
+                lines.extend(f"   → {action}" for action in high_priority[:3])
             
             # Conseils par position
             conseils = analysis_result.get('conseils_positions', [])
             if conseils:
-                print(f"\n📋 CONSEILS PAR POSITION:")
+                lines.append(f"\n📋 CONSEILS PAR POSITION:")
                 for conseil in conseils:
                     ticker = conseil.get('ticker', 'N/A')
                     action = conseil.get('action', 'N/A')
                     urgence = conseil.get('urgence', '')
                     urgence_icon = '🔴' if urgence == 'Haute' else '🟡' if urgence == 'Moyenne' else '🟢'
-                    print(f"   {urgence_icon} {ticker}: {action}")
+                    lines.append(f"   {urgence_icon} {ticker}: {action}")
         
-        print(f"{'='*60}\n")
+        lines.append(f"{_BAR60}\n")
+        print("\n".join(lines))
         
         return analysis_result
         
     except Exception as e:
         print(f"❌ Erreur analyse portefeuille: {e}")
-        import traceback
         traceback.print_exc()
         return None
 
@@ -761,7 +976,6 @@ def check_new_tickers_job():
 
 
 if __name__ == "__main__":
-    import schedule
     import argparse
     
     # Parse command line arguments
@@ -780,10 +994,12 @@ if __name__ == "__main__":
     
     # Handle check mode (dry run)
     if args.check:
-        should_run, reason = should_run_daily_analysis()
+        today = datetime.now().strftime('%Y-%m-%d')
+        last_batch_date = get_last_batch_analysis_date()
+        should_run, reason = should_run_daily_analysis(last_batch_date, today)
         print(f"\n📅 Statut de l'analyse quotidienne:")
-        print(f"   📆 Date du jour: {datetime.now().strftime('%Y-%m-%d')}")
-        print(f"   📋 Dernière analyse batch: {get_last_batch_analysis_date() or 'Jamais'}")
+        print(f"   📆 Date du jour: {today}")
+        print(f"   📋 Dernière analyse batch: {last_batch_date or 'Jamais'}")
         print(f"   {'✅ À lancer' if should_run else '⏸️ Déjà fait'}: {reason}")
         
         never_analyzed = get_tickers_needing_analysis()
@@ -809,6 +1025,9 @@ if __name__ == "__main__":
         run_analysis()
         exit(0)
 
+    # Mode daemon uniquement: les modes CLI ci-dessus ne chargent pas le scheduler
+    import schedule
+
     print("""
 ╔═══════════════════════════════════════════════════════════╗
 ║   🤖 BOT D'ANALYSE FINANCIÈRE (V5 - SIMPLIFIED)           ║
@@ -851,7 +1070,7 @@ if __name__ == "__main__":
     print("🚀 Vérification au démarrage...")
     
     # Check if news summaries need to be generated
-    if NEWS_AVAILABLE:
+    if _news_fetcher():
         print("📰 Génération des résumés d'actualités...")
         update_news_summaries()
     
@@ -862,11 +1081,13 @@ if __name__ == "__main__":
     print("\n💼 Vérification de l'analyse portefeuille...")
     run_portfolio_analysis()
 
-    print("\n" + "="*60)
+    print(f"\n{_BAR60}")
     print("🔄 Scheduler actif - En attente des prochains jobs...")
     print("   🌙 Prochain job nocturne: 03:00")
-    print("="*60 + "\n")
+    print(f"{_BAR60}\n")
 
     while True:
         schedule.run_pending()
-        time.sleep(60)
+        # Dormir jusqu'au prochain job (borné pour rester réactif aux changements d'horloge)
+        idle = schedule.idle_seconds()
+        time.sleep(60 if idle is None else min(max(idle, 1), 300))
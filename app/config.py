@@ -18,20 +18,55 @@ DEFAULT_CONFIG = {
     "num_threads": 12
 }
 
+# Configurations déjà lues: {chemin: (mtime, config)}
+_config_cache = {}
+
+
+def get_config_mtime(config_path='/app/config.json'):
+    """Retourne le mtime du fichier de configuration (0 s'il est absent)"""
+    try:
+        return os.path.getmtime(config_path)
+    except OSError:
+        return 0
+
+
+def invalidate_config_cache(config_path=None):
+    """
+    Oublie la configuration mise en cache, à appeler après une écriture du fichier.
+    
+    Args:
+        config_path: Fichier à invalider (tous si None)
+    """
+    if config_path is None:
+        _config_cache.clear()
+    else:
+        _config_cache.pop(config_path, None)
+
+
 def load_config(config_path='/app/config.json'):
-    """Charge la configuration depuis config.json"""
+    """
+    Charge la configuration depuis config.json.
+    Le fichier n'est relu (et parsé) que si son mtime a changé depuis le dernier appel.
+    """
     try:
         if os.path.exists(config_path):
+            mtime = get_config_mtime(config_path)
+            cached = _config_cache.get(config_path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            
             with open(config_path, 'r') as f:
                 config = json.load(f)
                 print(f"✅ Configuration chargée: {len(config.get('tickers', []))} actions à surveiller")
                 print(f"🤖 Modèle: {config.get('model', 'non spécifié')}")
                 print(f"⚡ Parallélisme: {'Activé' if config.get('parallel_analysis', False) else 'Désactivé'}")
                 print(f"🔧 Threads: {config.get('num_threads', 12)}")
+                _config_cache[config_path] = (mtime, config)
                 return config
         else:
             with open(config_path, 'w') as f:
                 json.dump(DEFAULT_CONFIG, f, indent=2)
+            invalidate_config_cache(config_path)
             print(f"⚙️ Fichier de configuration créé: {config_path}")
             return DEFAULT_CONFIG
     except Exception as e:
@@ -1,6 +1,13 @@
 """Récupération des données de marché via Yahoo Finance (CORRIGÉ)"""
+import time
 import yfinance as yf
 
+# Durée de validité des données enrichies en cache (relances rapprochées du même ticker)
+FETCH_CACHE_TTL = 300  # secondes
+
+# Cache en mémoire: {ticker: (instant monotonic, données)}
+_enhanced_cache = {}
+
 
 def fetch_stock_data(ticker):
     """
@@ -29,9 +36,22 @@ def fetch_stock_data(ticker):
 
 def fetch_enhanced_stock_data(ticker):
     """
-    Récupère les données enrichies d'une action
+    Récupère les données enrichies d'une action (cache de FETCH_CACHE_TTL secondes)
     Retourne: (hist_1mo, analysis_data, actions) ou None en cas d'erreur
     """
+    cached = _enhanced_cache.get(ticker)
+    if cached is not None and time.monotonic() - cached[0] < FETCH_CACHE_TTL:
+        return cached[1]
+    
+    data = _fetch_enhanced_stock_data(ticker)
+    # Seuls les succès sont mis en cache: un échec est retenté au prochain appel
+    if data is not None:
+        _enhanced_cache[ticker] = (time.monotonic(), data)
+    return data
+
+
+def _fetch_enhanced_stock_data(ticker):
+    """Requêtes Yahoo Finance de fetch_enhanced_stock_data (sans cache)"""
     try:
         stock = yf.Ticker(ticker)
         
@@ -42,6 +62,8 @@ def fetch_enhanced_stock_data(ticker):
             return None
         
         # 2. Indicateurs Clés (Dictionnaire personnalisé)
+        # Requêtes annexes en séquence sur le même yf.Ticker (ses caches internes ne sont pas
+        # thread-safe); le parallélisme se fait entre actions, sous le limiteur Yahoo
         # Gestion sécurisée des recommendations
         try:
             recos = stock.recommendations
@@ -49,9 +71,10 @@ def fetch_enhanced_stock_data(ticker):
         except Exception:
             recos_data = None
         
-        # Gestion sécurisée des news
+        # Gestion sécurisée des news (propriété lue une seule fois)
         try:
-            news_data = stock.news[:5] if stock.news else []
+            news = stock.news
+            news_data = news[:5] if news else []
         except Exception:
             news_data = []
         
@@ -93,7 +116,7 @@ def calculate_variations(hist_5d, hist_1mo):
     Calcule les variations de prix sur 1 jour et 1 mois
     
     Args:
-        hist_5d: DataFrame avec données horaires sur 5 jours
+        hist_5d: DataFrame des derniers jours (horaire ou journalier)
         hist_1mo: DataFrame avec données journalières sur 1 mois
     
     Returns:
@@ -107,20 +130,19 @@ def calculate_variations(hist_5d, hist_1mo):
         if hist_5d is not None and not hist_5d.empty and len(hist_5d) >= 2:
             # Pour les données horaires, on compare avec la clôture du jour précédent
             # Regrouper par jour pour avoir les clôtures journalières
-            daily_closes = hist_5d['Close'].resample('D').last().dropna()
+            daily_closes = hist_5d['Close'].resample('D').last().dropna().to_numpy()
             
             if len(daily_closes) >= 2:
-                var_1d = ((daily_closes.iloc[-1] - daily_closes.iloc[-2]) / 
-                          daily_closes.iloc[-2] * 100)
+                var_1d = (daily_closes[-1] - daily_closes[-2]) / daily_closes[-2] * 100
             else:
                 # Alternative: comparer première et dernière valeur
-                var_1d = ((hist_5d['Close'].iloc[-1] - hist_5d['Close'].iloc[0]) / 
-                          hist_5d['Close'].iloc[0] * 100)
+                closes = hist_5d['Close'].to_numpy()
+                var_1d = (closes[-1] - closes[0]) / closes[0] * 100
         
         # Variation sur 1 mois (données journalières)
         if hist_1mo is not None and not hist_1mo.empty and len(hist_1mo) >= 2:
-            var_1mo = ((hist_1mo['Close'].iloc[-1] - hist_1mo['Close'].iloc[0]) / 
-                       hist_1mo['Close'].iloc[0] * 100)
+            closes = hist_1mo['Close'].to_numpy()
+            var_1mo = (closes[-1] - closes[0]) / closes[0] * 100
         
         return float(var_1d), float(var_1mo)
     
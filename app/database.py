@@ -4,8 +4,9 @@ Remplace le stockage JSON pour une meilleure maintenabilité.
 """
 
 import os
+import json
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, JSON, ForeignKey, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, Session
@@ -14,8 +15,24 @@ from sqlalchemy.orm import sessionmaker, relationship, Session
 DATABASE_PATH = os.getenv('DATABASE_PATH', '/app/data/finance.db')
 DATABASE_URL = f'sqlite:///{DATABASE_PATH}'
 
+# Sérialisation des colonnes JSON: orjson (C) si disponible, sinon json standard
+# (ce module est aussi monté dans les conteneurs dashboard/portfolio/mail sans orjson)
+try:
+    import orjson
+
+    def _json_serializer(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+
+    _json_deserializer = orjson.loads
+except ImportError:
+    _json_serializer = json.dumps
+    _json_deserializer = json.loads
+
 # SQLAlchemy setup
-engine = create_engine(DATABASE_URL, echo=False, connect_args={'check_same_thread': False})
+engine = create_engine(
+    DATABASE_URL, echo=False, connect_args={'check_same_thread': False},
+    json_serializer=_json_serializer, json_deserializer=_json_deserializer
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -444,6 +461,77 @@ def get_db() -> Session:
     return SessionLocal()
 
 
+def _add_analysis(db: Session, data: Dict[str, Any]) -> Analysis:
+    """
+    Ajoute une analyse (et ses indicateurs / données structurées) à la session, sans commit.
+    
+    Args:
+        db: Session ouverte
+        data: Dictionnaire avec les données de l'analyse (format legacy JSON)
+        
+    Returns:
+        L'objet Analysis ajouté (ID attribué via flush)
+    """
+    # Créer l'analyse principale
+    analysis = Analysis(
+        ticker=data.get('ticker'),
+        timestamp=datetime.fromisoformat(data['timestamp']) if isinstance(data.get('timestamp'), str) else data.get('timestamp', datetime.now()),
+        price=data.get('price'),
+        change_1d=data.get('change_1d'),
+        change_1mo=data.get('change_1mo'),
+        model=data.get('model'),
+        analysis_time=data.get('analysis_time'),
+        signal=data.get('signal'),
+        confidence=data.get('confidence'),
+        summary=data.get('summary'),
+        news_analyzed=data.get('news_analyzed', 0),
+        analysis=data.get('analysis'),
+        raw_response=data.get('raw_response'),
+    )
+    
+    db.add(analysis)
+    db.flush()  # Pour obtenir l'ID
+    
+    # Ajouter les indicateurs si présents
+    indicators_data = data.get('indicators', {})
+    if indicators_data:
+        indicator = Indicator(
+            analysis_id=analysis.id,
+            rsi=indicators_data.get('rsi'),
+            ma_20=indicators_data.get('ma_20'),
+            ma_50=indicators_data.get('ma_50'),
+            ma_200=indicators_data.get('ma_200'),
+            macd=indicators_data.get('macd'),
+            macd_signal=indicators_data.get('macd_signal'),
+            macd_histogram=indicators_data.get('macd_histogram'),
+            bb_upper=indicators_data.get('bb_upper'),
+            bb_middle=indicators_data.get('bb_middle'),
+            bb_lower=indicators_data.get('bb_lower'),
+            bb_position=indicators_data.get('bb_position'),
+            volume_avg=indicators_data.get('volume_avg'),
+            volume_current=indicators_data.get('volume_current'),
+            volume_ratio=indicators_data.get('volume_ratio'),
+            atr=indicators_data.get('atr'),
+            atr_percent=indicators_data.get('atr_percent'),
+            stoch_k=indicators_data.get('stoch_k'),
+            stoch_d=indicators_data.get('stoch_d'),
+            resistance=indicators_data.get('resistance'),
+            support=indicators_data.get('support'),
+        )
+        db.add(indicator)
+    
+    # Ajouter les données structurées si présentes
+    structured = data.get('structured_data')
+    if structured:
+        structured_obj = StructuredData(
+            analysis_id=analysis.id,
+            data=structured
+        )
+        db.add(structured_obj)
+    
+    return analysis
+
+
 def save_analysis(data: Dict[str, Any]) -> Optional[Analysis]:
     """
     Sauvegarde une analyse dans la base de données.
@@ -456,63 +544,7 @@ def save_analysis(data: Dict[str, Any]) -> Optional[Analysis]:
     """
     db = get_db()
     try:
-        # Créer l'analyse principale
-        analysis = Analysis(
-            ticker=data.get('ticker'),
-            timestamp=datetime.fromisoformat(data['timestamp']) if isinstance(data.get('timestamp'), str) else data.get('timestamp', datetime.now()),
-            price=data.get('price'),
-            change_1d=data.get('change_1d'),
-            change_1mo=data.get('change_1mo'),
-            model=data.get('model'),
-            analysis_time=data.get('analysis_time'),
-            signal=data.get('signal'),
-            confidence=data.get('confidence'),
-            summary=data.get('summary'),
-            news_analyzed=data.get('news_analyzed', 0),
-            analysis=data.get('analysis'),
-            raw_response=data.get('raw_response'),
-        )
-        
-        db.add(analysis)
-        db.flush()  # Pour obtenir l'ID
-        
-        # Ajouter les indicateurs si présents
-        indicators_data = data.get('indicators', {})
-        if indicators_data:
-            indicator = Indicator(
-                analysis_id=analysis.id,
-                rsi=indicators_data.get('rsi'),
-                ma_20=indicators_data.get('ma_20'),
-                ma_50=indicators_data.get('ma_50'),
-                ma_200=indicators_data.get('ma_200'),
-                macd=indicators_data.get('macd'),
-                macd_signal=indicators_data.get('macd_signal'),
-                macd_histogram=indicators_data.get('macd_histogram'),
-                bb_upper=indicators_data.get('bb_upper'),
-                bb_middle=indicators_data.get('bb_middle'),
-                bb_lower=indicators_data.get('bb_lower'),
-                bb_position=indicators_data.get('bb_position'),
-                volume_avg=indicators_data.get('volume_avg'),
-                volume_current=indicators_data.get('volume_current'),
-                volume_ratio=indicators_data.get('volume_ratio'),
-                atr=indicators_data.get('atr'),
-                atr_percent=indicators_data.get('atr_percent'),
-                stoch_k=indicators_data.get('stoch_k'),
-                stoch_d=indicators_data.get('stoch_d'),
-                resistance=indicators_data.get('resistance'),
-                support=indicators_data.get('support'),
-            )
-            db.add(indicator)
-        
-        # Ajouter les données structurées si présentes
-        structured = data.get('structured_data')
-        if structured:
-            structured_obj = StructuredData(
-                analysis_id=analysis.id,
-                data=structured
-            )
-            db.add(structured_obj)
-        
+        analysis = _add_analysis(db, data)
         db.commit()
         db.refresh(analysis)
         
@@ -529,6 +561,38 @@ def save_analysis(data: Dict[str, Any]) -> Optional[Analysis]:
         db.close()
 
 
+def save_analyses(items: List[Dict[str, Any]]) -> int:
+    """
+    Sauvegarde plusieurs analyses en une seule transaction (un seul commit/fsync).
+    En cas d'erreur, repli sur une sauvegarde individuelle pour ne perdre que les analyses fautives.
+    
+    Args:
+        items: Liste de dictionnaires d'analyses (format legacy JSON)
+    
+    Returns:
+        Nombre d'analyses sauvegardées
+    """
+    if not items:
+        return 0
+    
+    db = get_db()
+    try:
+        # IDs lus avant le commit (après commit les objets sont expirés)
+        saved = [(a.ticker, a.id) for a in (_add_analysis(db, data) for data in items)]
+        db.commit()
+        for ticker, analysis_id in saved:
+            print(f"💾 Sauvegardé en DB: {ticker} (ID: {analysis_id})")
+        return len(saved)
+    
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Erreur sauvegarde groupée ({len(items)} analyses): {e} - repli individuel")
+    finally:
+        db.close()
+    
+    return sum(1 for data in items if save_analysis(data))
+
+
 def get_analyses(ticker: Optional[str] = None, days: int = 7, limit: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Récupère les analyses depuis la base de données.
@@ -612,29 +676,61 @@ def get_latest_analyses(tickers: List[str]) -> Dict[str, Dict[str, Any]]:
     Returns:
         Dictionnaire {ticker: analyse}
     """
-    from sqlalchemy import func
-    
     if not tickers:
         return {}
     
     db = get_db()
     try:
-        # Sous-requête pour obtenir la dernière analyse par ticker
-        subquery = db.query(
-            Analysis.ticker,
-            func.max(Analysis.timestamp).label('max_timestamp')
-        ).filter(
-            Analysis.ticker.in_(tickers)
-        ).group_by(Analysis.ticker).subquery()
+        return {a.ticker: a.to_dict() for a in _query_latest_analyses(db, tickers)}
         
-        # Requête principale
-        analyses = db.query(Analysis).join(
-            subquery,
-            (Analysis.ticker == subquery.c.ticker) & 
-            (Analysis.timestamp == subquery.c.max_timestamp)
-        ).all()
+    finally:
+        db.close()
+
+
+def _query_latest_analyses(db: Session, tickers: List[str]) -> List[Analysis]:
+    """Dernière analyse de chaque ticker, en une seule requête dans la session fournie"""
+    from sqlalchemy import func
+    
+    # Sous-requête pour obtenir la dernière analyse par ticker
+    subquery = db.query(
+        Analysis.ticker,
+        func.max(Analysis.timestamp).label('max_timestamp')
+    ).filter(
+        Analysis.ticker.in_(tickers)
+    ).group_by(Analysis.ticker).subquery()
+    
+    # Requête principale
+    return db.query(Analysis).join(
+        subquery,
+        (Analysis.ticker == subquery.c.ticker) & 
+        (Analysis.timestamp == subquery.c.max_timestamp)
+    ).all()
+
+
+def get_open_positions_with_analyses() -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Récupère les positions ouvertes et la dernière analyse de leurs tickers
+    dans une seule session (2 requêtes au lieu d'une par ticker).
+    
+    Returns:
+        (positions avec P&L, {ticker: analyse})
+    """
+    db = get_db()
+    try:
+        positions = db.query(Position).filter(
+            Position.status == 'open'
+        ).order_by(Position.entry_date.desc()).all()
         
-        return {a.ticker: a.to_dict() for a in analyses}
+        if not positions:
+            return [], {}
+        
+        latest = _query_latest_analyses(db, list({p.ticker for p in positions}))
+        latest_prices = {a.ticker: a.price for a in latest}
+        
+        return (
+            [p.to_dict(current_price=latest_prices.get(p.ticker)) for p in positions],
+            {a.ticker: a.to_dict() for a in latest}
+        )
         
     finally:
         db.close()
@@ -4,16 +4,37 @@ News Fetcher - Récupération et résumé IA des actualités financières
 
 import os
 import json
+import hashlib
 import time
 import finnhub
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
+# orjson (C) si disponible pour encoder le corps des requêtes Ollama
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+except ImportError:
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
 # Configuration
 FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY', '')
 OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://ollama:11434')
 CACHE_DURATION = timedelta(minutes=30)
+# Même num_ctx que les analyses (ai_analysis.OLLAMA_NUM_CTX): un num_ctx différent
+# forcerait Ollama à recharger le modèle entre résumés et analyses
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', '16384'))
+# Résumés générés en parallèle (aligné sur OLLAMA_NUM_PARALLEL côté serveur)
+SUMMARY_WORKERS = int(os.getenv('OLLAMA_NUM_PARALLEL', '3'))
+
+# Session HTTP partagée: la connexion vers Ollama est réutilisée (keep-alive)
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
 # Tickers nécessitant une recherche par keyword
 TICKER_KEYWORDS = {
@@ -204,6 +225,9 @@ class NewsFetcher:
 
 # Singleton
 _fetcher: Optional[NewsFetcher] = None
+# Résumés déjà générés, indexés par empreinte (modèle + prompt): un prompt
+# identique (mêmes articles en cache) ne repasse pas par Ollama
+_summary_cache = NewsCache()
 
 def get_news_fetcher() -> NewsFetcher:
     global _fetcher
@@ -251,6 +275,7 @@ def generate_news_summary(tickers: List[str], category: str = 'all') -> Dict[str
     for cat, arts in news.items():
         print(f"   {cat}: {len(arts)} articles")
     
+    to_generate = []
     for cat in categories:
         articles = news.get(cat, [])
         if not articles:
@@ -259,8 +284,16 @@ def generate_news_summary(tickers: List[str], category: str = 'all') -> Dict[str
             continue
         used_count = min(len(articles), 8)
         print(f"\n🔄 Génération résumé pour {cat} ({used_count}/{len(articles)} articles)...")
-        summaries[cat] = _generate_summary(cat, articles, tickers)
-        print(f"   ✅ Résumé généré: {len(summaries[cat].get('summary', ''))} chars")
+        to_generate.append(cat)
+    
+    # Appels Ollama en parallèle: chaque résumé attend surtout le modèle (I/O)
+    if to_generate:
+        workers = max(1, min(SUMMARY_WORKERS, len(to_generate)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {cat: executor.submit(_generate_summary, cat, news[cat], tickers) for cat in to_generate}
+            for cat, future in futures.items():
+                summaries[cat] = future.result()
+                print(f"   ✅ Résumé généré ({cat}): {len(summaries[cat].get('summary', ''))} chars")
     
     print(f"\n✅ Tous les résumés générés")
     return {'success': True, 'summaries': summaries, 'generated_at': datetime.now().isoformat()}
@@ -342,12 +375,19 @@ ANALYSE:"""
 
 IMPORTANT: Réponds UNIQUEMENT avec l'analyse demandée. Ne mets PAS de balises <think> ou de raisonnement intermédiaire. Commence directement par l'analyse."""
     
+    cache_key = hashlib.sha256(f"{model}|{clean_prompt}".encode('utf-8')).hexdigest()
+    if cached := _summary_cache.get(cache_key):
+        print(f"   ✅ Cache hit: résumé {category} déjà généré")
+        return cached
+    
     try:
         # Use chat API for better standardization across models
-        # Large timeout (10 min) to handle slow models without retry overhead
-        response = requests.post(
+        # Streamed response: the 10 min timeout now applies between chunks,
+        # and tokens are accumulated while the model is still generating
+        response = _SESSION.post(
             f"{OLLAMA_URL}/api/chat",
-            json={
+            headers={'Content-Type': 'application/json'},
+            data=_json_dumps({
                 "model": model,
                 "messages": [
                     {
@@ -355,53 +395,61 @@ IMPORTANT: Réponds UNIQUEMENT avec l'analyse demandée. Ne mets PAS de balises
                         "content": clean_prompt
                     }
                 ],
-                "stream": False,
+                "stream": True,
                 "options": {
                     "temperature": 0.7,
                     "num_predict": 500,
-                    "num_thread": num_threads
+                    "num_thread": num_threads,
+                    "num_ctx": OLLAMA_NUM_CTX
                 }
-            },
-            timeout=600
+            }),
+            timeout=600,
+            stream=True
         )
         
         print(f"   📡 Response status: {response.status_code}")
         
         if response.status_code == 200:
-            result = response.json()
-            summary_text = ""
+            # NDJSON stream: one JSON object per line, the last one has "done"
+            # (read to the end so the connection goes back to the pool)
+            content_parts = []
+            thinking_parts = []
+            result = {}
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                message = result.get('message') or {}
+                content_parts.append(message.get('content') or result.get('response', ''))
+                thinking_parts.append(message.get('thinking') or result.get('thinking', ''))
             
-            # Extract content from various possible response formats
-            if 'message' in result and 'content' in result['message']:
-                # Chat API response format
-                summary_text = result['message']['content'].strip()
-            elif 'response' in result:
-                # Generate API response format
-                summary_text = result.get('response', '').strip()
-            elif 'thinking' in result:
+            summary_text = ''.join(content_parts).strip()
+            if not summary_text:
                 # DeepSeek-R1 thinking field
-                summary_text = result.get('thinking', '').strip()
+                summary_text = ''.join(thinking_parts).strip()
                 
-            # Clean up any thinking tags that might remain
+            # Clean up any thinking tags that might remain: keep what follows the last </think>
             if '<think>' in summary_text and '</think>' in summary_text:
-                parts = summary_text.split('</think>')
-                summary_text = parts[-1].strip() if len(parts) > 1 else summary_text.replace('<think>', '').replace('</think>', '').strip()
+                summary_text = summary_text.rpartition('</think>')[2]
             
             # Remove standalone <think> or </think> tags
             summary_text = summary_text.replace('<think>', '').replace('</think>', '').strip()
             
             # Debug if still empty
             if len(summary_text) == 0:
-                print(f"   🔍 Full result keys: {result.keys()}")
-                print(f"   🔍 Result preview: {str(result)[:300]}")
+                print(f"   🔍 Last chunk keys: {result.keys()}")
+                print(f"   🔍 Last chunk preview: {str(result)[:300]}")
             
             print(f"   ✅ Résumé reçu: {len(summary_text)} chars")
-            return {
+            result = {
                 'summary': summary_text,
                 'article_count': len(articles),
                 'sources': list(set(a['source'] for a in articles[:5])),
                 'generated_at': datetime.now().isoformat()
             }
+            if summary_text:
+                _summary_cache.set(cache_key, result)
+            return result
         else:
             print(f"   ❌ Erreur Ollama: {response.text[:200]}")
     except Exception as e:
@@ -2,6 +2,21 @@
 import re
 import json
 
+# orjson (C) si disponible, sinon json standard
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Clôtures markdown ```json ... ``` en début/fin de réponse
+_FENCE_RE = re.compile(r'^```[\w-]*[ \t]*\n?|\n?[ \t]*```$')
+
+
+def strip_code_fences(text):
+    """Retire les blocs de code markdown (```json ... ```) entourant une réponse IA"""
+    return _FENCE_RE.sub('', text.strip()).strip()
+
 
 def extract_signal_from_analysis(analysis_text):
     """
@@ -35,18 +50,10 @@ def _try_parse_json(analysis_text):
     """
     try:
         # Nettoyer le texte (enlever markdown code blocks si présents)
-        clean_text = analysis_text.strip()
-        
-        # Retirer les blocs de code markdown ```json ... ```
-        if clean_text.startswith('```'):
-            # Trouver le premier saut de ligne et le dernier ```
-            first_newline = clean_text.find('\n')
-            last_backticks = clean_text.rfind('```')
-            if first_newline > 0 and last_backticks > first_newline:
-                clean_text = clean_text[first_newline:last_backticks].strip()
+        clean_text = strip_code_fences(analysis_text)
         
         # Parser le JSON
-        data = json.loads(clean_text)
+        data = _json_loads(clean_text)
         
         # Valider les champs requis
         if not isinstance(data, dict):
@@ -0,0 +1,83 @@
+"""Tests de non-régression du prompt d'analyse (build_analysis_prompt)"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+np = pytest.importorskip('numpy')
+pytest.importorskip('ollama')
+
+from ai_analysis import build_analysis_prompt
+from indicators import get_technical_indicators
+
+
+def _hist(close=110.0):
+    """Historique d'une seule séance"""
+    return pd.DataFrame({
+        'Open': [close - 1],
+        'High': [close + 1],
+        'Low': [close - 2],
+        'Close': [close],
+        'Volume': [1_000_000],
+    })
+
+
+def _trend_hist(start, end, days):
+    """Historique de `days` séances, clôtures linéaires de start à end (prix numpy)"""
+    close = np.linspace(start, end, days)
+    return pd.DataFrame({
+        'Open': close - 1,
+        'High': close + 1,
+        'Low': close - 2,
+        'Close': close,
+        'Volume': np.full(days, 1_000_000.0),
+    })
+
+
+def _ma_line(prompt, label):
+    lines = [line for line in prompt.splitlines() if f'**{label}:**' in line]
+    assert len(lines) == 1, f"{label}: {lines}"
+    return lines[0]
+
+
+def _ma200_lines(prompt):
+    return [line for line in prompt.splitlines() if 'MA200' in line]
+
+
+def test_ma200_line_rendered_when_present():
+    """La branche MA200 s'affiche sans NameError (ancien bug ma200 / ma_200)"""
+    prompt = build_analysis_prompt('AAPL', _hist(110.0), {}, {'ma_200': 100.0})
+
+    lines = _ma200_lines(prompt)
+    assert len(lines) == 1
+    assert '100.00$' in lines[0]
+    assert 'AU-DESSUS' in lines[0]
+
+
+def test_ma200_line_omitted_when_missing():
+    """Moins de 200 séances: ma_200 vaut None et la ligne MA200 est absente"""
+    prompt = build_analysis_prompt('AAPL', _hist(110.0), {}, {'ma_200': None, 'ma_20': 105.0})
+
+    assert _ma200_lines(prompt) == []
+
+
+def test_ma_lines_with_numpy_prices():
+    """Prix et moyennes en types numpy (numpy.bool à la comparaison): MA20, MA50 et MA200 rendues"""
+    hist = _trend_hist(90.0, 110.0, 30)
+    indicators = {
+        'ma_20': np.float64(120.0),
+        'ma_50': np.float64(100.0),
+        'ma_200': np.float32(95.0),
+    }
+    prompt = build_analysis_prompt('AAPL', hist, {}, indicators)
+
+    assert '120.00$' in _ma_line(prompt, 'MA20') and 'EN-DESSOUS' in _ma_line(prompt, 'MA20')
+    assert '100.00$' in _ma_line(prompt, 'MA50') and 'AU-DESSUS' in _ma_line(prompt, 'MA50')
+    assert '95.00$' in _ma_line(prompt, 'MA200') and 'AU-DESSUS' in _ma_line(prompt, 'MA200')
+
+
+def test_ma_lines_from_computed_indicators():
+    """Chaîne réelle: indicateurs calculés sur 250 séances haussières, prix au-dessus des trois MA"""
+    hist = _trend_hist(100.0, 150.0, 250)
+    prompt = build_analysis_prompt('AAPL', hist, {}, get_technical_indicators(hist))
+
+    for label in ('MA20', 'MA50', 'MA200'):
+        assert 'AU-DESSUS' in _ma_line(prompt, label)